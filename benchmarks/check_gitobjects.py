@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+Regression check of the native Git backend, comparing everything
+that it reads from the object database against ``git`` itself,
+on a synthetic repository with deltified packs and loose objects.
+
+Exits with non-zero status if there are any differences.
+"""
+import argparse
+from binascii import hexlify, unhexlify
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT_DIR)
+
+from coded4 import vcs
+from coded4.gitobjects import (OBJECT_TYPES, WALK_SLOP, Repository,
+                               parse_commit)
+
+from synthrepo import generate_git_repo
+
+
+#: Number of commits made on top of the packed history,
+#: so that some objects are loose
+LOOSE_COMMITS = 5
+
+#: Maximum number of commits that may be read when walking the history
+#: after a commit, on top of the new ones and their parents
+MAX_EXTRA_READS = 2 * WALK_SLOP
+
+
+def main():
+    parser = create_argument_parser()
+    args = parser.parse_args()
+
+    repo_dir = os.path.abspath(os.path.join(args.workdir, 'gitobjects-%d-%d'
+                                            % (args.commits, args.seed)))
+    prepare_repo(repo_dir, args)
+
+    failures = 0
+    for check in (check_objects, check_commits, check_history,
+                  check_incremental_walk):
+        errors = list(check(repo_dir))
+        for error in errors[:args.max_errors]:
+            print >>sys.stderr, "%s: %s" % (check.__name__, error)
+        print "%s: %s" % (check.__name__,
+                          "%d errors" % len(errors) if errors else "OK")
+        failures += len(errors)
+
+    sys.exit(1 if failures else 0)
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Check the native Git backend against git itself")
+    parser.add_argument('--commits', type=int, default=2000, metavar="N",
+                        help="Number of commits in the synthetic repository")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of the random number generator")
+    parser.add_argument('--workdir', default='bench_repos', metavar="DIR",
+                        help="Directory where the repository is generated")
+    parser.add_argument('--max-errors', type=int, default=10, metavar="N",
+                        help="Number of errors of every check to print")
+    return parser
+
+
+def prepare_repo(path, args):
+    """Generates the repository, repacking it aggressively
+    (so that most objects are deltas, many levels deep)
+    and adding a few loose commits on top.
+    """
+    generate_git_repo(path, args.commits, 10, 'bursty', args.seed)
+    git(path, 'repack', '-a', '-d', '-f', '-q', '--depth=50', '--window=50')
+
+    env = dict(os.environ, GIT_AUTHOR_NAME='Loose Author',
+               GIT_AUTHOR_EMAIL='loose@example.com',
+               GIT_COMMITTER_NAME='Loose Committer',
+               GIT_COMMITTER_EMAIL='loose@example.com')
+    for i in xrange(0, LOOSE_COMMITS):
+        with open(os.path.join(path, 'loose.txt'), 'a') as f:
+            f.write('%d\n' % i)
+        git(path, 'add', 'loose.txt')
+        git(path, 'commit', '-q', '-m', 'Loose commit %d\n\nWith body.' % i,
+            env=env)
+
+
+def check_objects(path):
+    """Compares types and contents of all objects in the repository.
+    :return: Iterable of error messages
+    """
+    objects = git(path, 'cat-file', '--batch-all-objects',
+                  '--batch-check=%(objectname) %(objecttype)').split('\n')
+    repo = Repository(path)
+    try:
+        cat_file = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=path,
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE)
+        for line in filter(None, objects):
+            sha, type_name = line.split()
+            cat_file.stdin.write(sha + '\n')
+            cat_file.stdin.flush()
+            size = int(cat_file.stdout.readline().split()[2])
+            expected = cat_file.stdout.read(size + 1)[:-1]
+
+            obj_type, data = repo.read_object(unhexlify(sha))
+            if obj_type != OBJECT_TYPES[type_name]:
+                yield "%s has type %s instead of %s" % (sha, obj_type,
+                                                        type_name)
+            elif data != expected:
+                yield "%s has different content" % sha
+        cat_file.stdin.close()
+        cat_file.wait()
+    finally:
+        repo.close()
+
+
+def check_commits(path):
+    """Compares parents, authors, times and subjects of all commits.
+    :return: Iterable of error messages
+    """
+    log = git(path, 'log', '--all', '-z',
+              '--format=%H%x0a%P%x0a%an%x0a%at%x0a%ct%x0a%s')
+    repo = Repository(path)
+    try:
+        for record in filter(None, log.split('\0')):
+            sha, parents, author, time, commit_time, subject = record.split(
+                '\n', 5)
+            commit = parse_commit(repo.read_object(unhexlify(sha))[1])
+            actual = (map(hexlify, commit.parents), commit.author,
+                      commit.time, commit.commit_time, commit.message)
+            expected = (parents.split(), author, int(time), int(commit_time),
+                        subject)
+            if actual != expected:
+                yield "%s is %r instead of %r" % (sha, actual, expected)
+    finally:
+        repo.close()
+
+
+def check_history(path):
+    """Compares the history retrieved by ``git`` and ``git-native`` backends.
+    :return: Iterable of error messages
+    """
+    histories = [sorted(vcs.retrieve_commit_history(path, vcs_name,
+                                                    details=True))
+                 for vcs_name in ('git', 'git-native')]
+    if histories[0] != histories[1]:
+        missing = set(histories[0]) - set(histories[1])
+        extra = set(histories[1]) - set(histories[0])
+        yield "%d commits missing, %d extra" % (len(missing), len(extra))
+
+
+def check_incremental_walk(path):
+    """Checks that walking the history after one of the recent commits
+    visits the same commits as ``git rev-list``, and reads only a few
+    more of them than that.
+
+    :return: Iterable of error messages
+    """
+    repo = Repository(path)
+    reads = [0]
+    read_commit = repo.read_commit
+
+    def counting_read_commit(sha):
+        reads[0] += 1
+        return read_commit(sha)
+    repo.read_commit = counting_read_commit
+
+    try:
+        head = repo.resolve_ref('HEAD')
+        for count in xrange(1, LOOSE_COMMITS + 1):
+            after = git(path, 'rev-parse', 'HEAD~%d' % count).strip()
+            expected = git(path, 'rev-list', 'HEAD', '--not', after).split()
+
+            reads[0] = 0
+            walked = [hexlify(sha) for sha, _ in
+                      repo.walk_commits([head], [unhexlify(after)])]
+            if sorted(walked) != sorted(expected):
+                yield "walk after HEAD~%d visits %d commits instead of %d" % (
+                    count, len(walked), len(expected))
+            if reads[0] > 2 * len(expected) + MAX_EXTRA_READS:
+                yield "walk after HEAD~%d reads %d commits for %d new ones" % (
+                    count, reads[0], len(expected))
+    finally:
+        repo.close()
+
+
+# Utilities
+
+def git(path, *args, **kwargs):
+    """Runs git command in given repository.
+    :return: Its output
+    """
+    return subprocess.check_output(('git',) + args, cwd=path, **kwargs)
+
+
+if __name__ == '__main__':
+    main()
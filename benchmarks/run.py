@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+Benchmark suite, timing every stage of coded4 pipeline
+on synthetic repositories.
+
+Results are printed (or written to a file) as JSON,
+so that they can be compared between versions.
+"""
+import argparse
+from datetime import timedelta
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT_DIR)
+
+import coded4
+from coded4 import approx, cluster, output, stats, vcs
+from coded4.__main__ import (APPROXIMATION_ALGORITHMS, CLUSTERING_ALGORITHMS,
+                             OUTPUT_FORMATS)
+
+from synthrepo import DISTRIBUTIONS, generate_repo
+
+
+#: Number of commits in the repository that startup time is measured with
+TINY_REPO_COMMITS = 10
+
+
+def main():
+    parser = create_argument_parser()
+    args = parser.parse_args()
+
+    results = []
+    for vcs_name in ([] if args.startup_only else args.vcs):
+        # alternative backends (like git-native) share the repositories
+        repo_type = vcs_name.split('-', 1)[0]
+        for commits in args.commits:
+            repo_dir = get_repo(repo_type, commits, args)
+            for stage, seconds, items in benchmark_repo(repo_dir, vcs_name,
+                                                        args):
+                results.append({
+                    'vcs': vcs_name,
+                    'commits': commits,
+                    'stage': stage,
+                    'seconds': seconds,
+                    'items': items,
+                })
+
+    startup = [{'command': command, 'seconds': seconds}
+               for command, seconds in benchmark_startup(
+                   get_repo('git', TINY_REPO_COMMITS, args), args)]
+
+    report = {
+        'coded4': coded4.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {
+            'authors': args.authors,
+            'distribution': args.distribution,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'epsilon': args.epsilon,
+            'cluster_algo': args.cluster_algo,
+            'approx_algo': args.approx_algo,
+        },
+        'results': results,
+        'startup': startup,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print json.dumps(report, indent=2)
+
+    if args.startup_budget is not None:
+        # budget applies to the time on top of interpreter's own startup
+        python_seconds = startup[0]['seconds']
+        over_budget = [s for s in startup[1:]
+                       if s['seconds'] - python_seconds > args.startup_budget]
+        for s in over_budget:
+            print >>sys.stderr, "Startup of '%s' over budget: %.3fs" % (
+                s['command'], s['seconds'] - python_seconds)
+        if over_budget:
+            sys.exit(1)
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark coded4 on synthetic repositories")
+
+    parser.add_argument('--vcs', nargs='+', default=['git'],
+                        choices=vcs.SUPPORTED_VCS, metavar="TYPE",
+                        help="Repository types to benchmark (default: git)")
+    parser.add_argument('--commits', type=int, nargs='+',
+                        default=[1000, 10000, 100000], metavar="N",
+                        help="Numbers of commits in synthetic repositories")
+    parser.add_argument('--authors', type=int, default=10, metavar="N",
+                        help="Number of authors in synthetic repositories")
+    parser.add_argument('--distribution', default='bursty',
+                        choices=DISTRIBUTIONS, metavar="NAME",
+                        help="Distribution of time between commits. "
+                             "Possible values: %(choices)s")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed for the random number generator")
+
+    parser.add_argument('--epsilon', type=int, default=30, metavar="MINUTES",
+                        help="Epsilon for clustering commits")
+    parser.add_argument('--cluster-algo', default='simple',
+                        choices=CLUSTERING_ALGORITHMS, metavar="ALGO",
+                        dest='cluster_algo')
+    parser.add_argument('--approx-algo', default='ten2five',
+                        choices=APPROXIMATION_ALGORITHMS, metavar="ALGO",
+                        dest='approx_algo')
+
+    parser.add_argument('--repeat', type=int, default=3, metavar="N",
+                        help="How many times every stage is timed "
+                             "(the best time is reported)")
+    parser.add_argument('--workdir', default='bench_repos', metavar="DIR",
+                        help="Directory where synthetic repositories are kept")
+    parser.add_argument('--output', '-o', default=None, metavar="FILE",
+                        help="File to write the JSON results to "
+                             "(standard output by default)")
+
+    parser.add_argument('--startup-only', action='store_true', default=False,
+                        help="Only measure the startup time of coded4",
+                        dest='startup_only')
+    parser.add_argument('--startup-budget', type=float, default=None,
+                        metavar="SECONDS", dest='startup_budget',
+                        help="Fail if coded4 takes longer than this to start "
+                             "(on top of starting Python itself)")
+
+    return parser
+
+
+def get_repo(repo_type, commits, args):
+    """Returns the directory of synthetic repository,
+    generating the repository if necessary.
+    """
+    repo_dir = os.path.join(args.workdir, '%s-%d-%d-%s-%d' % (
+        repo_type, commits, args.authors, args.distribution, args.seed))
+    if not os.path.isdir(repo_dir):
+        generate_repo(repo_type, repo_dir, commits,
+                      args.authors, args.distribution, args.seed)
+    return os.path.abspath(repo_dir)
+
+
+def benchmark_startup(repo_dir, args):
+    """Times how long it takes to run coded4 as a new process,
+    from the start until it exits.
+
+    :return: Iterable of (command name, best time in seconds) pairs,
+             starting with bare Python interpreter for comparison
+    """
+    commands = [
+        ('python', ['-c', 'pass']),
+        ('help', ['-m', 'coded4', '--help']),
+        ('tiny_repo', ['-m', 'coded4', repo_dir]),
+    ]
+    with open(os.devnull, 'w') as devnull:
+        for name, command in commands:
+            run = lambda _: subprocess.check_call([sys.executable] + command,
+                                                  cwd=ROOT_DIR, stdout=devnull)
+            seconds, _ = best_time(run, None, max(args.repeat, 10))
+            yield name, seconds
+
+
+def benchmark_repo(repo_dir, vcs_name, args):
+    """Times every stage of the pipeline for given repository.
+
+    Every stage's input is fully computed beforehand,
+    so that the stages are timed independently of each other.
+
+    :return: Iterable of (stage name, best time in seconds, items) tuples
+    """
+    epsilon = timedelta(minutes=args.epsilon)
+
+    # (stage name, function of previous stage's result, item count function)
+    stages = [
+        ('retrieve_commit_history',
+         lambda _: list(vcs.retrieve_commit_history(repo_dir, vcs_name)),
+         len),
+        ('group_by_contributors',
+         cluster.group_by_contributors,
+         lambda grouped: sum(map(len, grouped.itervalues()))),
+        ('cluster_commits',
+         lambda grouped: cluster.cluster_commits(grouped, args.cluster_algo,
+                                                 epsilon),
+         lambda clustered: sum(len(c.bounds) - 1
+                               for c in clustered.itervalues())),
+        ('approximate_coding_sessions',
+         lambda clustered: approx.approximate_coding_sessions(
+             clustered, args.approx_algo),
+         lambda sessions: sum(map(len, sessions.itervalues()))),
+        ('compute_time_stats',
+         lambda sessions: list(stats.compute_time_stats(sessions)),
+         len),
+    ]
+
+    result = None
+    for name, func, count in stages:
+        seconds, result = best_time(func, result, args.repeat)
+        yield name, seconds, count(result)
+
+    contributors = result
+    seconds, _ = best_time(stats.calculate_totals, contributors, args.repeat)
+    yield 'calculate_totals', seconds, len(contributors)
+
+    repo_name = os.path.basename(repo_dir)
+    for output_format in OUTPUT_FORMATS:
+        seconds, _ = best_time(
+            lambda contribs: output.format_output(repo_name, contribs,
+                                                  output_format),
+            contributors, args.repeat)
+        yield 'output_' + output_format, seconds, len(contributors)
+
+
+def best_time(func, arg, repeat):
+    """Calls the function with given argument a number of times.
+    :return: Tuple of the best time and the function's result
+    """
+    best = None
+    for _ in xrange(0, max(1, repeat)):
+        start = time.time()
+        result = func(arg)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+if __name__ == '__main__':
+    main()
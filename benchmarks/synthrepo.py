@@ -0,0 +1,92 @@
+"""
+Generator of synthetic repositories for benchmarks.
+"""
+import os
+import random
+import shutil
+from subprocess import Popen, PIPE, check_call
+
+
+#: Distributions of time between subsequent commits
+DISTRIBUTIONS = ['uniform', 'bursty']
+
+#: Timestamp of the first synthetic commit
+START_TIME = 1262304000  # 2010-01-01
+
+
+def commit_times(count, distribution, rng):
+    """Yields commit timestamps in chronological order.
+
+    :param distribution: Name of the distribution of time between commits:
+                         ``'uniform'`` spreads commits evenly (with mean gap
+                         of an hour), while ``'bursty'`` mimics coding sessions:
+                         bursts of commits separated by long breaks
+    """
+    time = START_TIME
+    for _ in xrange(0, count):
+        if distribution == 'uniform':
+            time += rng.randint(0, 2 * 3600)
+        elif distribution == 'bursty':
+            if rng.random() < 0.2:
+                time += rng.randint(2 * 3600, 3 * 24 * 3600)  # a break
+            else:
+                time += rng.randint(60, 30 * 60)  # within a session
+        else:
+            raise ValueError("Unknown distribution '%s'" % distribution)
+        yield time
+
+
+def generate_git_repo(path, commits, authors, distribution, seed=0):
+    """Generates a Git repository with synthetic history at given path.
+
+    History is streamed into ``git fast-import``, so arbitrarily large
+    repositories can be generated in constant memory.
+    """
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    check_call(['git', 'init', '-q', path])
+
+    rng = random.Random(seed)
+    names = ['Author %d' % i for i in xrange(0, authors)]
+
+    fast_import = Popen(['git', 'fast-import', '--quiet'],
+                        cwd=path, stdin=PIPE)
+    out = fast_import.stdin
+    for i, time in enumerate(commit_times(commits, distribution, rng)):
+        author = rng.randrange(0, authors)
+        message = 'Commit %d' % i
+        content = '%d\n' % i
+        out.write('commit refs/heads/master\n')
+        ident = '%s <%d@example.com> %d +0000' % (names[author], author, time)
+        out.write('author %s\ncommitter %s\n' % (ident, ident))
+        out.write('data %d\n%s\n' % (len(message), message))
+        out.write('M 644 inline file%d.txt\n' % (i % 100))
+        out.write('data %d\n%s\n' % (len(content), content))
+    out.close()
+    if fast_import.wait() != 0:
+        raise RuntimeError("git fast-import has failed")
+
+    check_call(['git', 'checkout', '-q', 'master'], cwd=path)
+
+
+def generate_hg_repo(path, commits, authors, distribution, seed=0):
+    """Generates a Mercurial repository with synthetic history at given path,
+    by converting a synthetic Git repository.
+    """
+    git_path = path + '.git-source'
+    generate_git_repo(git_path, commits, authors, distribution, seed)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    with open(os.devnull, 'w') as devnull:
+        check_call(['hg', '--config', 'extensions.convert=',
+                    'convert', '-q', git_path, path], stdout=devnull)
+    shutil.rmtree(git_path)
+
+
+def generate_repo(vcs_name, path, commits, authors, distribution, seed=0):
+    """Generates a repository of given VCS with synthetic history. """
+    generate_func = globals().get('generate_%s_repo' % vcs_name)
+    if not generate_func:
+        raise ValueError("Unsupported VCS '%s'" % vcs_name)
+    generate_func(path, commits, authors, distribution, seed)
@@ -6,9 +6,13 @@ from __future__ import unicode_literals
 
 import argparse
 from datetime import datetime, timedelta
+import os
+import sys
 
-from coded4 import approx, cluster, stats, vcs
-from coded4.output import format_output
+# other modules are imported only when needed, to make startup faster
+from coded4 import vcs
+from coded4.profiling import NO_TIMINGS, Timings
+from coded4.utils import default_cache_dir
 
 
 def main():
@@ -16,8 +20,99 @@ def main():
     args = argparser.parse_args()
 
     if args:
-        contributors = calculate_statistics(args)
-        print format_output(args.directory, contributors, args.output)
+        profiler = None
+        if args.profile_file:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        timings = Timings() if args.timings else NO_TIMINGS
+        directories = check_args(argparser, args, list_directories(args))
+
+        succeeded = True
+        if args.serve_address:
+            serve(args, directories)
+        elif args.watch_interval:
+            if len(directories) > 1:
+                argparser.error("--watch requires a single repository")
+            args.directory = directories[0]
+            watch_statistics(args, timings)
+        else:
+            succeeded = write_report(args, directories, timings)
+            if args.output != 'sessions':
+                print
+
+        if timings.enabled:
+            print >>sys.stderr, timings.format_report()
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile_file)
+        if not succeeded:
+            sys.exit(1)
+
+
+def check_args(argparser, args, directories):
+    """Checks whether command line args can be used together,
+    exiting with an error if they can't.
+
+    :return: List of directories to calculate statistics for
+    """
+    if ((args.epsilons or args.rollup or args.heatmap)
+            and len(directories) > 1 and not args.merge_repos):
+        argparser.error("--epsilon-sweep, --rollup and --heatmap require "
+                        "a single repository (or --merge)")
+    if args.paths and (len(directories) > 1 or args.merge_repos
+                       or args.epsilons or args.rollup or args.heatmap
+                       or args.watch_interval or args.serve_address):
+        argparser.error("--paths requires a single repository, and can't "
+                        "be used with --epsilon-sweep, --rollup, --heatmap, "
+                        "--watch or --serve")
+    if args.dedupe_forks and not args.merge_repos:
+        argparser.error("--dedupe-forks requires --merge")
+    if args.paths and args.vcs and not vcs.supports(args.vcs,
+                                                    'path_history'):
+        argparser.error("--paths can't be used with --repo %s" % args.vcs)
+    if args.watch_interval and (args.epsilons or args.rollup
+                                or args.heatmap):
+        argparser.error("--watch can't be used with --epsilon-sweep, "
+                        "--rollup or --heatmap")
+    if args.serve_address and (args.epsilons or args.rollup or args.heatmap
+                               or args.distributions):
+        argparser.error("--serve can't be used with --epsilon-sweep, "
+                        "--rollup, --heatmap or --distributions")
+    if args.output == 'sessions' and (
+            (len(directories) > 1 and not args.merge_repos) or args.paths
+            or args.epsilons or args.rollup or args.heatmap
+            or args.watch_interval or args.serve_address):
+        argparser.error("--format sessions requires a single repository "
+                        "(or --merge), and can't be used with --paths, "
+                        "--epsilon-sweep, --rollup, --heatmap, "
+                        "--watch or --serve")
+
+    if args.sessions_file:
+        if (args.directories or args.manifest or args.merge_repos
+                or args.paths or args.epsilons
+                or args.watch_interval or args.serve_address):
+            argparser.error("--from-sessions can't be used with repository "
+                            "directories, --merge, --paths, --epsilon-sweep, "
+                            "--watch or --serve")
+        from coded4.sessionfile import SessionFile
+        with SessionFile(args.sessions_file) as f:
+            directories = [f.repo_name]  # only for naming the output
+
+    from coded4.approx import CHURN_APPROXIMATIONS
+    if args.approx_algo in CHURN_APPROXIMATIONS and (
+            args.merge_repos or args.paths or args.epsilons
+            or args.watch_interval or args.serve_address):
+        argparser.error("--approx-algo %s can't be used with --merge, "
+                        "--paths, --epsilon-sweep, --watch or --serve"
+                        % args.approx_algo)
+    if args.approx_algo in CHURN_APPROXIMATIONS and args.vcs and (
+            not vcs.supports(args.vcs, 'churn_history')):
+        argparser.error("--approx-algo %s can't be used with --repo %s"
+                        % (args.approx_algo, args.vcs))
+
+    return directories
 
 
 def create_argument_parser():
@@ -27,9 +122,19 @@ def create_argument_parser():
 
     # add general arguments
     parser.add_argument(
-        'directory', type=str, default='.',
-        help="Directory where the repository is contained (. by default)",
+        'directories', type=str, nargs='*',
+        help="Directories where the repositories are contained "
+             "(. by default)",
         metavar="DIRECTORY")
+    parser.add_argument(
+        '--manifest', '-m', type=str, default=None,
+        help="File with a list of repository directories, one per line",
+        metavar="FILE", dest='manifest')
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=None,
+        help="Number of repositories to process in parallel "
+             "(default: number of CPUs)",
+        metavar="N", dest='jobs')
     parser.add_argument(
         '--repo', '-r', type=str, default=None, choices=vcs.SUPPORTED_VCS,
         help="Repository type for which the stats should be generated",
@@ -37,7 +142,8 @@ def create_argument_parser():
     parser.add_argument(
         '--format', '-f', type=str, default='table', choices=OUTPUT_FORMATS,
         help="Output format (formatted table by default). "
-             "Possible choices: %(choices)s",
+             "Possible choices: %(choices)s; 'sessions' is a binary file "
+             "with every coding session, see --from-sessions",
         metavar="FORMAT", dest='output')
 
     # add filtering arguments
@@ -50,6 +156,31 @@ def create_argument_parser():
                         help="Include only commits before specified date (%s)"
                               % DATETIME_FORMAT.replace('%', ''),
                         metavar="DATE", dest='until')
+    parser.add_argument('--refs', type=lambda s: s.split(','), default=None,
+                        help="Include only commits from specified "
+                             "comma-separated refs: branches, tags "
+                             "or bookmarks (by default, Git uses "
+                             "the current branch and Hg uses all changesets)",
+                        metavar="REFS", dest='refs')
+    parser.add_argument('--all-refs', action='store_const',
+                        const=vcs.ALL_REFS, dest='refs',
+                        help="Include commits from all branches, tags "
+                             "and bookmarks")
+    parser.add_argument('--no-merges', action='store_false', default=True,
+                        help="Exclude merge commits",
+                        dest='merges')
+
+    def paths(spec):
+        from collections import OrderedDict
+        from coded4.paths import normalize_path
+        return list(OrderedDict.fromkeys(map(normalize_path, spec.split(','))))
+    parser.add_argument('--paths', type=paths, default=None,
+                        help="Calculate statistics separately for each of "
+                             "specified comma-separated directories within "
+                             "the repository (e.g. services/api,services/web), "
+                             "in a single pass over its history "
+                             "(which isn't cached)",
+                        metavar="PATHS", dest='paths')
 
     # add algorithms
     parser.add_argument(
@@ -63,21 +194,97 @@ def create_argument_parser():
         help="What algorithms should be used to approximate time spent coding. "
              "Possible values: %(choices)s",
         metavar="ALGO", dest='approx_algo')
+    parser.add_argument(
+        '--merge', action='store_true', default=False,
+        help="Merge commits of every contributor across all the repositories "
+             "before finding their coding sessions, so that time spent "
+             "on many repositories at once is counted only once",
+        dest='merge_repos')
+    parser.add_argument(
+        '--dedupe-forks', action='store_true', default=False,
+        help="With --merge, count commits of a contributor made at the same "
+             "second in different repositories (e.g. forks) only once",
+        dest='dedupe_forks')
 
     # add other options
     minutes = lambda m: timedelta(minutes=int(m))
+
+    def epsilon_sweep(spec):
+        from coded4.sweep import parse_epsilons
+        return parse_epsilons(spec)
     parser.add_argument(
         '--epsilon', '--eps', '-e', type=minutes,
         default=minutes(DEFAULT_EPSILON_MINUTES),
         help="Maximum time between commits which are still considered "
              "a single coding session (default: %s)" % DEFAULT_EPSILON_MINUTES,
         metavar="MINUTES", dest='epsilon')
+    parser.add_argument(
+        '--epsilon-sweep', type=epsilon_sweep, default=None,
+        help="Calculate number of sessions and time for many values "
+             "of epsilon at once, given as comma-separated minutes "
+             "and/or START:STOP[:STEP] ranges (e.g. 5:30:5,45,60)",
+        metavar="SPEC", dest='epsilons')
+    parser.add_argument(
+        '--distributions', action='store_true', default=False,
+        help="Add median and 90th percentile of session length, commits "
+             "per session and gap between sessions to the statistics",
+        dest='distributions')
+    parser.add_argument(
+        '--rollup', type=str, default=None, choices=ROLLUP_PERIODS,
+        help="Split coding time of every contributor into calendar periods. "
+             "Possible values: %(choices)s",
+        metavar="PERIOD", dest='rollup')
+    parser.add_argument(
+        '--heatmap', action='store_true', default=False,
+        help="Split coding time of every contributor into hours "
+             "of every weekday (in local time)",
+        dest='heatmap')
+    parser.add_argument(
+        '--from-sessions', type=str, default=None,
+        help="Calculate statistics from coding sessions in a file written "
+             "with --format sessions, instead of a repository "
+             "(clustering and approximation options have no effect)",
+        metavar="FILE", dest='sessions_file')
+    parser.add_argument(
+        '--cache', nargs='?', type=str, default=None,
+        const=default_cache_dir(),
+        help="Cache the commit history on disk, so that subsequent runs "
+             "only fetch new commits (default cache directory: %(const)s)",
+        metavar="DIR", dest='cache_dir')
+    parser.add_argument(
+        '--watch', nargs='?', type=float, default=None,
+        const=DEFAULT_WATCH_INTERVAL,
+        help="Keep running, checking the repository for new commits "
+             "every SECONDS (default: %(const)s) and writing updated "
+             "statistics whenever there are any",
+        metavar="SECONDS", dest='watch_interval')
+    parser.add_argument(
+        '--serve', type=str, default=None,
+        help="Run an HTTP server answering queries about statistics "
+             "of given repositories, keeping their history in memory. "
+             "ADDRESS is either [HOST]:PORT or path to Unix socket; "
+             "--jobs sets the number of threads handling requests",
+        metavar="ADDRESS", dest='serve_address')
+
+    # add instrumentation options
+    parser.add_argument(
+        '--timings', '-t', action='store_true', default=False,
+        help="Report wall & CPU time, peak memory usage and item counts "
+             "for every stage of calculation (on standard error)",
+        dest='timings')
+    parser.add_argument(
+        '--profile', type=str, default=None,
+        help="Profile the run with cProfile and dump the stats to given file "
+             "(in batch mode, only the main process is profiled)",
+        metavar="FILE", dest='profile_file')
 
     return parser
 
 
 DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
-OUTPUT_FORMATS = ['table', 'csv', 'json', 'yaml', 'plist', 'xml', 'sexp']
+OUTPUT_FORMATS = ['table', 'csv', 'json', 'yaml', 'plist', 'xml', 'sexp',
+                  'sessions']
+ROLLUP_PERIODS = ['day', 'week', 'month']
 CLUSTERING_ALGORITHMS = ['simple']
 APPROXIMATION_ALGORITHMS = {
     'null': "Null approximation (i.e. uses only time between commits), "
@@ -87,29 +294,429 @@ APPROXIMATION_ALGORITHMS = {
                 "and 5 minutes after last commit",
     'quarter_end': "Uses average time between commits in session, "
                    "adding 1/4th of it after last commit",
+    'churn': "Adds 5 to 60 minutes before first commit, growing with "
+             "the number of lines changed in session, and 5 minutes "
+             "after last commit (reads diffs of all commits, "
+             "bypassing the cache)",
 }
 
 DEFAULT_EPSILON_MINUTES = 30
+DEFAULT_WATCH_INTERVAL = 10
 
 
 ### Logic
 
-def calculate_statistics(args):
+def write_report(args, directories, timings=NO_TIMINGS):
+    """Calculates statistics and writes them to standard output,
+    as dictated by command line args.
+
+    :return: Whether statistics of all the repositories were calculated
+    """
+    from coded4 import sweep
+    from coded4.output import (write_batch_output, write_output,
+                               write_path_output, write_rows)
+
+    if args.merge_repos:
+        # commits from all the repositories are treated as if they came
+        # from a single one, named after their number
+        args.merged_directories = directories
+        directories = ['%d repositories' % len(directories)]
+
+    if args.epsilons or args.rollup or args.heatmap:
+        args.directory = directories[0]
+        if args.epsilons:
+            rows = calculate_epsilon_sweep(args, timings)
+            totals = sweep.sweep_totals(rows)
+        elif args.rollup:
+            from coded4 import rollup
+            rows = calculate_rollup(args, timings)
+            totals = rollup.rollup_totals(rows)
+        else:
+            from coded4 import heatmap
+            rows = calculate_heatmap(args, timings)
+            totals = heatmap.heatmap_totals(rows)
+        timings.measure('formatting', write_rows, sys.stdout,
+                        args.directory, rows, totals, args.output,
+                        header=True)
+    elif args.paths:
+        args.directory = directories[0]
+        results = calculate_path_statistics(args, timings)
+        timings.measure('formatting', write_path_output, sys.stdout,
+                        args.directory, results, args.output)
+    elif len(directories) > 1:
+        results = calculate_batch_statistics(args, directories)
+        timings.measure('formatting', write_batch_output, sys.stdout,
+                        [(directory, contributors)
+                         for directory, contributors in results
+                         if contributors is not None], args.output)
+        return all(contributors is not None for _, contributors in results)
+    else:
+        args.directory = directories[0]
+        contributors = calculate_statistics(args, timings)
+        timings.measure('formatting', write_output, sys.stdout,
+                        args.directory, contributors, args.output)
+    return True
+
+
+def watch_statistics(args, timings=NO_TIMINGS):
+    """Writes statistics to standard output, and then keeps updating them
+    as new commits appear in the repository.
+    """
+    from coded4 import stats, watch
+    from coded4.output import write_output
+
+    def start():
+        tip = vcs.retrieve_tip(args.directory, args.vcs, refs=args.refs)
+        grouped_commits = retrieve_grouped_commits(args, timings, tip)
+        return tip, watch.SessionTracker(grouped_commits, args.cluster_algo,
+                                         args.epsilon, args.approx_algo)
+
+    def write(tracker):
+        contributors = sort_contributors(stats.compute_time_stats(
+            tracker.coding_sessions, args.distributions))
+        write_output(sys.stdout, args.directory, contributors, args.output)
+        print
+        sys.stdout.flush()
+
+    tip, tracker = start()
+    write(tracker)
+    try:
+        for new_commits in watch.follow(args.directory, args.vcs, tip,
+                                        args.watch_interval,
+                                        refs=args.refs, merges=args.merges):
+            if new_commits is None:
+                tip, tracker = start()  # history was rewritten
+            else:
+                tracker.add_commits(vcs.filter_interval(
+                    new_commits, (args.since, args.until)))
+            print
+            write(tracker)
+    except KeyboardInterrupt:
+        pass
+
+
+def list_directories(args):
+    """Lists the directories of repositories to calculate statistics for,
+    as given in command line args and/or the manifest file.
+    """
+    directories = list(args.directories)
+    if args.manifest:
+        manifest_dir = os.path.dirname(args.manifest)
+        with open(args.manifest) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    directories.append(os.path.join(manifest_dir, line))
+    return directories or ['.']
+
+
+def serve(args, directories):
+    """Serves statistics of given repositories over HTTP,
+    as dictated by command line args.
+    """
+    import multiprocessing
+    from coded4 import server
+
+    repos = {}
+    for directory in directories:
+        name = os.path.basename(os.path.abspath(directory))
+        if name in repos:
+            raise ValueError("Duplicate repository name '%s'" % name)
+        repos[name] = server.Repository(directory, args.vcs, args.cache_dir,
+                                        refs=args.refs, merges=args.merges)
+
+    defaults = {'cluster_algo': args.cluster_algo,
+                'approx_algo': args.approx_algo,
+                'epsilon': args.epsilon,
+                'format': args.output}
+    workers = args.jobs or multiprocessing.cpu_count()
+    httpd = server.create_server(args.serve_address, repos, defaults,
+                                 workers=workers)
+    print >>sys.stderr, "Serving %d repositories at %s" % (
+        len(repos), args.serve_address)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+def calculate_batch_statistics(args, directories):
+    """Calculates statistics for many repositories in parallel,
+    as dictated by command line args.
+
+    :return: List of (directory, contributors) pairs, in the order
+             of given directories; contributors are None for directories
+             whose statistics couldn't be calculated
+    """
+    jobs = [(args, directory) for directory in directories]
+    contributors = parallel_map(calculate_repo_statistics, jobs, args.jobs)
+    return zip(directories, contributors)
+
+
+def calculate_repo_statistics(job):
+    """Calculates statistics of a single repository within a batch.
+    :param job: Pair of command line args and repository directory
+    """
+    args, directory = job
+    repo_args = argparse.Namespace(**vars(args))
+    repo_args.directory = directory
+
+    timings = Timings() if args.timings else NO_TIMINGS
+    try:
+        contributors = calculate_statistics(repo_args, timings)
+    except Exception as e:  # a single repository shouldn't fail the batch
+        print >>sys.stderr, "Skipping %s: %s" % (directory, e)
+        return None
+    if timings.enabled:
+        print >>sys.stderr, timings.format_report(title=directory)
+
+    # batch output needs only the counters (and distributions),
+    # so sessions aren't sent back to the parent process
+    return [c._replace(sessions=None) for c in contributors]
+
+
+def parallel_map(func, jobs, processes):
+    """Maps given function over list of jobs in a pool of processes.
+
+    :param processes: Maximum number of processes, or None to use
+                      as many as there are CPUs
+    :return: List of results, in the order of jobs
+    """
+    import multiprocessing
+
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(max(1, min(processes, len(jobs))))
+    try:
+        return pool.map(func, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def calculate_path_statistics(args, timings=NO_TIMINGS):
+    """Calculates statistics for many paths within a single repository,
+    as dictated by command line args.
+
+    :return: List of (path, contributors) pairs, in the order of paths
+    """
+    from coded4.paths import split_by_paths
+
+    path_history = vcs.retrieve_path_history(
+        args.directory, args.vcs, (args.since, args.until),
+        refs=args.refs, merges=args.merges)
+    histories = timings.measure(
+        'history', split_by_paths, path_history, args.paths,
+        count=lambda histories: sum(map(len, histories.itervalues())))
+
+    results = []
+    for path in args.paths:
+        grouped_commits = timings.measure(
+            'grouping', histories.pop(path).group_by_authors,
+            count=lambda grouped: sum(map(len, grouped.itervalues())))
+        results.append((path, calculate_statistics(args, timings,
+                                                   grouped_commits)))
+    return results
+
+
+def calculate_statistics(args, timings=NO_TIMINGS, grouped_commits=None):
     """Calculates statistics, as dictated by command line args.
+
+    :param timings: Optional Timings object to record measurements
+                    of every stage of calculation in
+    :param grouped_commits: Optional commits grouped by contributors;
+                            by default, they're retrieved from repository
     :return: List of Contributor tuples
     """
-    commit_history = vcs.retrieve_commit_history(
-        args.directory, args.vcs, (args.since, args.until))
+    from coded4 import stats
+
+    coding_sessions = calculate_coding_sessions(args, timings,
+                                                grouped_commits)
+    contributors = timings.measure(
+        'stats', lambda: sort_contributors(
+            stats.compute_time_stats(coding_sessions, args.distributions)),
+        count=len)
+
+    return contributors
+
+
+def sort_contributors(contributors):
+    """Sorts contributors in the order they are output in.
+    :return: List of Contributor tuples
+    """
+    return sorted(contributors, key=lambda c: c.session_count, reverse=True)
+
+
+def calculate_rollup(args, timings=NO_TIMINGS):
+    """Calculates coding time in calendar periods,
+    as dictated by command line args.
+
+    :param timings: Optional Timings object to record measurements
+                    of every stage of calculation in
+    :return: List of output dictionaries, one for every contributor
+    """
+    from coded4 import rollup
+
+    coding_sessions = calculate_coding_sessions(args, timings)
+    return timings.measure(
+        'rollup', rollup.rollup_coding_sessions, coding_sessions, args.rollup,
+        count=len)
+
+
+def calculate_heatmap(args, timings=NO_TIMINGS):
+    """Calculates coding time in every hour of the week,
+    as dictated by command line args.
+
+    :param timings: Optional Timings object to record measurements
+                    of every stage of calculation in
+    :return: List of output dictionaries, seven for every contributor
+    """
+    from coded4 import heatmap
+
+    coding_sessions = calculate_coding_sessions(args, timings)
+    return timings.measure(
+        'heatmap', heatmap.heatmap_coding_sessions, coding_sessions,
+        count=len)
+
+
+def calculate_coding_sessions(args, timings=NO_TIMINGS, grouped_commits=None):
+    """Calculates coding sessions of every contributor,
+    as dictated by command line args.
+
+    :param grouped_commits: Optional commits grouped by contributors;
+                            by default, they're retrieved from repository
+    :return: Dictionary mapping contributor names to lists of Sessions
+    """
+    from coded4 import approx, cluster
+
+    if args.sessions_file:
+        from coded4.sessionfile import SessionFile
+        with SessionFile(args.sessions_file) as f:
+            return timings.measure(
+                'reading', f.coding_sessions,
+                count=lambda sessions: sum(map(len, sessions.itervalues())))
+
+    churn = None
+    if grouped_commits is None:
+        if args.approx_algo in approx.CHURN_APPROXIMATIONS:
+            grouped_commits, churn = retrieve_grouped_churn(args, timings)
+        else:
+            grouped_commits = retrieve_grouped_commits(args, timings)
+    clustered_commits = timings.measure(
+        'clustering', cluster.cluster_commits,
+        grouped_commits, args.cluster_algo, args.epsilon,
+        count=lambda clustered: sum(len(c.bounds) - 1
+                                    for c in clustered.itervalues()))
+
+    return timings.measure(
+        'approximation', approx.approximate_coding_sessions,
+        clustered_commits, args.approx_algo, churn,
+        count=lambda sessions: sum(map(len, sessions.itervalues())))
+
+
+def calculate_epsilon_sweep(args, timings=NO_TIMINGS):
+    """Calculates statistics for many values of epsilon,
+    as dictated by command line args.
+
+    :param timings: Optional Timings object to record measurements
+                    of every stage of calculation in
+    :return: List of output dictionaries, one for every contributor
+    """
+    from coded4 import sweep
+
+    grouped_commits = retrieve_grouped_commits(args, timings)
+    return timings.measure(
+        'sweep', sweep.sweep_epsilons, grouped_commits, args.epsilons,
+        args.cluster_algo, args.approx_algo, count=len)
+
+
+def retrieve_grouped_commits(args, timings=NO_TIMINGS, tip=None):
+    """Retrieves commit history of the repository and groups it
+    by contributors, as dictated by command line args.
+
+    :param tip: Optional revision, as returned by
+                :func:`coded4.vcs.retrieve_tip`, to retrieve the history up to
+    :return: Dictionary mapping author names to arrays of their commit
+             timestamps, from the latest to the earliest
+    """
+    from coded4 import cluster
+
+    if getattr(args, 'merged_directories', None):
+        return retrieve_merged_commits(args, timings)
 
-    grouped_commits = cluster.group_by_contributors(commit_history)
-    clustered_commits = cluster.cluster_commits(
-        grouped_commits, args.cluster_algo, args.epsilon)
+    interval = (args.since, args.until)
+    if args.cache_dir:
+        from coded4 import cache
+        commit_history = cache.cached_commit_history(
+            args.directory, args.vcs, interval, args.cache_dir,
+            refs=args.refs, merges=args.merges, tip=tip)
+    else:
+        commit_history = vcs.retrieve_commit_history(
+            args.directory, args.vcs, interval,
+            refs=args.refs, merges=args.merges, tip=tip)
+    if timings.enabled:
+        # otherwise, history is streamed right into the grouping stage
+        commit_history = timings.measure('history', list, commit_history,
+                                         count=len)
 
-    coding_sessions = approx.approximate_coding_sessions(
-        clustered_commits, args.approx_algo)
-    contributors = stats.compute_time_stats(coding_sessions)
+    return timings.measure(
+        'grouping', cluster.group_by_contributors, commit_history,
+        count=lambda grouped: sum(map(len, grouped.itervalues())))
 
-    return sorted(contributors, key=lambda c: len(c.commits), reverse=True)
+
+def retrieve_grouped_churn(args, timings=NO_TIMINGS):
+    """Retrieves commit history of the repository, along with the numbers
+    of lines changed by commits, and groups both by contributors.
+
+    :return: Pair of dictionaries mapping author names to arrays of their
+             commit timestamps, from the latest to the earliest, and to arrays
+             of lines changed by those commits
+    """
+    from coded4 import cluster
+
+    churn_history = vcs.retrieve_churn_history(
+        args.directory, args.vcs, (args.since, args.until),
+        refs=args.refs, merges=args.merges)
+    if timings.enabled:
+        churn_history = timings.measure('history', list, churn_history,
+                                        count=len)
+
+    return timings.measure(
+        'grouping', cluster.group_churn_by_contributors, churn_history,
+        count=lambda (grouped, _): sum(map(len, grouped.itervalues())))
+
+
+def retrieve_merged_commits(args, timings=NO_TIMINGS):
+    """Retrieves commit history of many repositories in parallel,
+    grouping it by contributors and merging across repositories.
+
+    :return: Dictionary mapping author names to arrays of their commit
+             timestamps, from the latest to the earliest
+    """
+    from coded4 import cluster
+
+    jobs = [(args, directory) for directory in args.merged_directories]
+    grouped_commits = timings.measure(
+        'history', parallel_map, retrieve_repo_commits, jobs, args.jobs,
+        count=lambda results: sum(len(times) for grouped in results
+                                  for times in grouped.itervalues()))
+
+    return timings.measure(
+        'merging', cluster.merge_grouped_commits, grouped_commits,
+        args.dedupe_forks, count=lambda merged: sum(map(len, merged.itervalues())))
+
+
+def retrieve_repo_commits(job):
+    """Retrieves grouped commits of a single repository
+    for merging with others.
+    :param job: Pair of command line args and repository directory
+    """
+    args, directory = job
+    repo_args = argparse.Namespace(**vars(args))
+    repo_args.directory = directory
+    repo_args.merged_directories = None
+    return retrieve_grouped_commits(repo_args)
 
 
 if __name__ == '__main__':
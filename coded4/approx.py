@@ -2,33 +2,32 @@
 Algorithms for approximating coding sessions
 """
 from collections import namedtuple
-from datetime import timedelta
+from itertools import imap, islice, izip, repeat
+import math
+import operator
 
-from taipan.collections import dicts
-from taipan.functional.combinators import curry
 
-
-class Session(namedtuple('Session',
-                         ['commits', 'time_before_first', 'time_after_last'])):
+class Session(namedtuple('Session', ['start', 'end', 'commits',
+                                     'time_before_first', 'time_after_last',
+                                     'total_time'])):
     """Represents a single coding session.
 
-    Session consists of commits, plus some approximated time before the first
-    and after last commit.
+    Session consists of commits made between ``start`` and ``end`` timestamps,
+    plus some approximated time before the first and after last commit.
+    All the times are expressed in seconds, and ``total_time``
+    is precomputed from the others.
     """
-    @property
-    def total_time(self):
-        total = self.time_before_first + self.time_after_last
-        if self.commits:
-            total += self.commits[0].time - self.commits[-1].time
-        return total
 
 
-def approximate_coding_sessions(clustered_commits, approx_algo):
+def approximate_coding_sessions(clustered_commits, approx_algo, churn=None):
     """Approximates the coding sessions that resulted in given clustered commits.
 
     :param clustered_commits: Dictionary mapping contributor names
-                              to lists of Commit clusters
+                              to Clusters of their commits
     :param approx_algo: Name of approximation algorithm
+    :param churn: Dictionary mapping contributor names to arrays of lines
+                  changed by their commits (in the same order as commits
+                  in Clusters), required by :data:`CHURN_APPROXIMATIONS`
 
     :return: Dictionary mapping contributor names to lists of Session tuples
     """
@@ -36,60 +35,119 @@ def approximate_coding_sessions(clustered_commits, approx_algo):
     if not approx_func:
         raise ValueError("Unknown approximation '%s'" % approx_algo)
 
-    return dicts.mapvalues(curry(map, approx_func), clustered_commits)
+    if approx_algo in CHURN_APPROXIMATIONS:
+        if churn is None:
+            raise ValueError("Approximation '%s' requires lines changed "
+                             "by commits" % approx_algo)
+        return dict(
+            (author, approximate_sessions(clusters, approx_func, churn[author]))
+            for author, clusters in clustered_commits.iteritems())
+
+    return dict((author, approximate_sessions(clusters, approx_func))
+                for author, clusters in clustered_commits.iteritems())
+
+
+def approximate_sessions(clusters, approx_func, churn=None):
+    """Approximates all coding sessions of a single contributor at once.
+
+    :param clusters: Clusters of contributor's commits
+    :param approx_func: Approximation function, taking lists of commit counts
+                        and time spans of every session (and lines changed
+                        in them, if ``churn`` is given), and returning
+                        iterables of times before first & after last commit
+    :param churn: Optional array of lines changed by contributor's commits
+
+    :return: List of Session tuples
+    """
+    times, bounds = clusters
+    firsts = bounds[:-1]
+    lasts = imap(operator.sub, islice(bounds, 1, None), repeat(1))
+
+    # sessions are delimited by offsets of their latest & earliest commits
+    ends = map(times.__getitem__, firsts)
+    starts = map(times.__getitem__, lasts)
+    counts = map(operator.sub, islice(bounds, 1, None), firsts)
+    spans = map(operator.sub, ends, starts)
+
+    if churn is None:
+        before_first, after_last = approx_func(counts, spans)
+    else:
+        churns = [sum(churn[first:last]) for first, last
+                  in izip(firsts, islice(bounds, 1, None))]
+        before_first, after_last = approx_func(counts, spans, churns)
+    return [Session(start, end, count, before, after, before + after + span)
+            for start, end, count, span, before, after
+            in izip(starts, ends, counts, spans, before_first, after_last)]
 
 
 ## Algorithms
 
-SINGLE_COMMIT_TIMES = timedelta(minutes=5), timedelta()
+MINUTE = 60
+SINGLE_COMMIT_TIMES = 5 * MINUTE, 0
+
+#: Approximations which also take the numbers of lines changed in sessions
+CHURN_APPROXIMATIONS = frozenset(['churn'])
 
+#: Time added before the first commit of session in churn approximation:
+#: the base, plus a step for every tenfold increase of lines changed
+#: (past CHURN_LINES_UNIT), up to the maximum
+CHURN_BASE_TIME = 5 * MINUTE
+CHURN_STEP_TIME = 10 * MINUTE
+CHURN_MAX_TIME = 60 * MINUTE
+CHURN_LINES_UNIT = 10.0
 
-def null_approximation(commit_cluster):
+
+def null_approximation(counts, spans):
     """A "null" approximation that doesn't add any additional time.
     Useful for testing but not for much else.
     """
-    return Session(commit_cluster, timedelta(), timedelta())
+    return repeat(0), repeat(0)
 
 
-def start10_approximation(commit_cluster):
+def start10_approximation(counts, spans):
     """A simple approximation that adds 10 minutes
     before the first commit in cluster.
     """
-    return Session(commit_cluster, timedelta(minutes=10), timedelta())
+    return repeat(10 * MINUTE), repeat(0)
 
 
-def ten2five_approximation(commit_cluster):
+def ten2five_approximation(counts, spans):
     """A simple approximation that adds 10 minutes before the first commit
     and 5 after the last one, except for sessions consisting of single commit.
     """
-    if len(commit_cluster) > 1:
-        return Session(commit_cluster,
-                       timedelta(minutes=10), timedelta(minutes=5))
-    return Session(commit_cluster, *SINGLE_COMMIT_TIMES)
+    multiple = [count > 1 for count in counts]
+    return (imap((SINGLE_COMMIT_TIMES[0], 10 * MINUTE).__getitem__, multiple),
+            imap((SINGLE_COMMIT_TIMES[1], 5 * MINUTE).__getitem__, multiple))
 
 
-def quarter_end_approximation(commit_cluster):
+def quarter_end_approximation(counts, spans):
     """A slightly more sophisticated approximation that uses
     the average time between commits in a session.
     """
-    diffs = commit_time_diff(commit_cluster)
-    if diffs:
-        average_diff = sum(diffs, timedelta()) / len(diffs)
-        before_first = average_diff
-        after_last = average_diff / 4    # quarter end
-        return Session(commit_cluster, before_first, after_last)
-
-    return Session(commit_cluster, *SINGLE_COMMIT_TIMES)
-
-
-## Utilities
-
-def commit_time_diff(commits):
-    """Returns time differences between commits. """
-    if not commits or len(commits) == 1:
-        return []
-
-    diffs = []
-    for i in xrange(0, len(commits) - 1):
-        diffs.append(commits[i].time - commits[i+1].time)
-    return diffs
+    before_first = []
+    after_last = []
+    for count, span in izip(counts, spans):
+        if count > 1:
+            average_diff = float(span) / (count - 1)
+            before_first.append(average_diff)
+            after_last.append(average_diff / 4)    # quarter end
+        else:
+            before_first.append(SINGLE_COMMIT_TIMES[0])
+            after_last.append(SINGLE_COMMIT_TIMES[1])
+    return before_first, after_last
+
+
+def churn_approximation(counts, spans, churns):
+    """An approximation that adds time before the first commit
+    according to the number of lines changed in session: 5 minutes
+    for trivial changes, about 15 for 100 lines, 25 for 1000 and so on
+    (up to an hour). After the last commit, it adds 5 minutes,
+    except for sessions consisting of single commit.
+    """
+    before_first = [min(CHURN_MAX_TIME,
+                        CHURN_BASE_TIME + CHURN_STEP_TIME *
+                        math.log10(1 + churn / CHURN_LINES_UNIT))
+                    for churn in churns]
+    return (before_first,
+            imap((SINGLE_COMMIT_TIMES[1], 5 * MINUTE).__getitem__,
+                 (count > 1 for count in counts)))
@@ -0,0 +1,181 @@
+"""
+Persistent on-disk cache of commit history.
+"""
+import cPickle as pickle
+from hashlib import sha1
+from itertools import islice
+import operator
+import os
+
+from coded4 import vcs
+from coded4.utils import default_cache_dir
+
+
+#: Version of the cache format; bumping it invalidates existing caches
+CACHE_VERSION = 4
+
+#: Number of commits that are pickled together as a single chunk
+CHUNK_SIZE = 4096
+
+
+def cached_commit_history(directory, vcs_name=None, interval=None,
+                          cache_dir=None, refs=None, merges=True,
+                          details=False, tip=None):
+    """Retrieves history of commits for given repository,
+    using (and updating) the on-disk cache.
+
+    Only commits made since the last cached revision are fetched
+    from the VCS; the rest are read back from the cache.
+
+    :param cache_dir: Directory where cache files are kept
+    :param refs: Refs whose commits are retrieved,
+                 see :func:`coded4.vcs.retrieve_commit_history`
+    :param merges: Whether merge commits are retrieved
+    :param details: Whether commit hashes and messages are retrieved
+    :param tip: Revision, as returned by :func:`coded4.vcs.retrieve_tip`,
+                which the history is retrieved up to; by default,
+                it's the current one
+    :return: Iterable of Commit tuples
+    """
+    vcs_name = vcs_name or vcs.detect_vcs(directory)
+    selection = dict(refs=refs, merges=merges, details=details)
+    tip = tip or vcs.retrieve_tip(directory, vcs_name, refs=refs)
+    if not tip:
+        return vcs.retrieve_commit_history(directory, vcs_name, interval,
+                                           **selection)
+
+    entry = CacheEntry(cache_dir or default_cache_dir(), directory, vcs_name,
+                       refs, merges, details)
+    with entry.lock():  # against other processes using the same entry
+        cached_tip, size = entry.read_tip()
+        if cached_tip != tip:
+            if cached_tip and vcs.contains_revision(directory, cached_tip,
+                                                    vcs_name, refs=refs):
+                # commits are retrieved up to the tip that's written below,
+                # even if new ones have arrived in the meantime
+                new_commits = vcs.retrieve_commit_history(
+                    directory, vcs_name, after_revision=cached_tip, tip=tip,
+                    **selection)
+                size = entry.append(new_commits, size)
+            else:
+                size = entry.write(vcs.retrieve_commit_history(
+                    directory, vcs_name, tip=tip, **selection))
+            entry.write_tip(tip, size)
+        commits = entry.read(size)
+
+    return vcs.filter_interval(commits, interval)
+
+
+class CacheEntry(object):
+    """Cached commit history of a single repository.
+
+    The entry consists of two files: a log of pickled chunks of commits,
+    and a small file with the tip revision that the log is current for
+    (along with the log's size, so that any partial writes can be discarded).
+    Unless details are cached, commits are stored as (time, author) pairs.
+
+    Entry should be locked (see :meth:`lock`) while it's being updated.
+    """
+    def __init__(self, cache_dir, directory, vcs_name, refs=None,
+                 merges=True, details=False):
+        key = '%s:%s' % (vcs_name, os.path.abspath(directory))
+        if refs is not None or not merges:
+            key += ':%r:%s' % (refs, merges)
+        if details:
+            key += ':details'
+        key = sha1(key)
+        self.details = details
+        basename = 'v%s-%s' % (CACHE_VERSION, key.hexdigest())
+        self.log_path = os.path.join(cache_dir, basename + '.log')
+        self.tip_path = os.path.join(cache_dir, basename + '.tip')
+        self.lock_path = os.path.join(cache_dir, basename + '.lock')
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def lock(self):
+        """Locks the entry exclusively, waiting for other processes
+        to release it first.
+
+        :return: Lock file, which releases the lock when closed
+                 (e.g. when used as context manager)
+        """
+        import fcntl
+        f = open(self.lock_path, 'a')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def read_tip(self):
+        """Reads the tip revision that the cached log is current for.
+        :return: Tuple of tip revision and the size of the log
+        """
+        try:
+            with open(self.tip_path) as f:
+                tip, size = f.read().rsplit(None, 1)  # tip may have spaces
+            if os.path.getsize(self.log_path) < int(size):
+                return None, 0
+            return tip, int(size)
+        except (IOError, OSError, ValueError):
+            return None, 0
+
+    def write_tip(self, tip, size):
+        tmp_path = self.tip_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('%s %s' % (tip, size))
+        os.rename(tmp_path, self.tip_path)
+
+    def read(self, size):
+        """Reads Commit tuples stored in the cached log.
+
+        The log is opened right away (while the entry is locked),
+        so that it can be read even after it's been rewritten since.
+
+        :param size: Size of the valid part of the log
+        :return: Iterable of Commit tuples
+        """
+        return self._read_chunks(open(self.log_path, 'rb'), size)
+
+    def _read_chunks(self, f, size):
+        with f:
+            while f.tell() < size:
+                if self.details:
+                    for fields in pickle.load(f):
+                        yield vcs.Commit(*fields)
+                else:
+                    for time, author in pickle.load(f):
+                        yield vcs.Commit(None, time, author, None)
+
+    def write(self, commits):
+        """Writes given commits as the new content of the log.
+        :return: Size of the log
+        """
+        if os.path.exists(self.tip_path):
+            os.remove(self.tip_path)  # until the new log is complete
+
+        tmp_path = self.log_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            size = self._write_chunks(commits, f)
+        os.rename(tmp_path, self.log_path)
+        return size
+
+    def append(self, commits, size):
+        """Appends given commits to the log,
+        discarding anything that follows its valid part.
+
+        :param size: Size of the valid part of the log
+        :return: New size of the log
+        """
+        with open(self.log_path, 'r+b') as f:
+            f.seek(size)
+            f.truncate()
+            return self._write_chunks(commits, f)
+
+    def _write_chunks(self, commits, f):
+        if self.details:
+            fields = tuple
+        else:
+            fields = operator.attrgetter('time', 'author')
+        commits = iter(commits)
+        for chunk in iter(lambda: list(islice(commits, CHUNK_SIZE)), []):
+            pickle.dump(map(fields, chunk), f, pickle.HIGHEST_PROTOCOL)
+        return f.tell()
@@ -1,63 +1,150 @@
 """
 Algorithms for clustering commits
 """
-from taipan.collections import dicts
-from taipan.functional.combinators import curry
+from array import array
+from collections import namedtuple
+import heapq
+from itertools import compress, count, groupby, imap, islice, izip, repeat
+import operator
+
+
+from coded4.history import CommitHistory, INT_TYPECODE
+
+
+class Clusters(namedtuple('Clusters', ['times', 'bounds'])):
+    """Commits of a single contributor, divided into clusters.
+
+    :param times: Array of commit timestamps, from the latest to the earliest
+    :param bounds: Array of offsets into ``times`` where subsequent clusters
+                   begin, followed by the total number of commits
+    """
 
 
 def group_by_contributors(commit_history):
     """Goes through commit history and groups commits by their authors.
-    :param commit_history: List of Commit tuples
-    :return: Dictionary mapping author names to lists of Commit tuples
+
+    :param commit_history: CommitHistory, or iterable of Commit tuples
+    :return: Dictionary mapping author names to arrays of their commit
+             timestamps, from the latest to the earliest
+    """
+    if not isinstance(commit_history, CommitHistory):
+        commit_history = CommitHistory(commit_history)
+    return commit_history.group_by_authors()
+
+
+def group_churn_by_contributors(churn_history):
+    """Goes through history of commits with numbers of lines they have changed
+    and groups both by commits' authors.
+
+    :param churn_history: Iterable of pairs of Commit tuples
+                          and numbers of lines changed
+    :return: Pair of dictionaries mapping author names to arrays of commit
+             timestamps, from the latest to the earliest, and to arrays
+             of lines changed by those commits (in the same order)
     """
-    commits = {}
-    for commit in commit_history:
-        commit_list = commits.setdefault(commit.author, [])
-        commit_list.append(commit)
+    changes_by_author = {}
+    for commit, churn in churn_history:
+        changes_by_author.setdefault(commit.author, []).append(
+            (commit.time, churn))
 
-    return commits
+    grouped_commits = {}
+    grouped_churn = {}
+    for author, changes in changes_by_author.iteritems():
+        changes.sort(reverse=True)
+        grouped_commits[author] = array(
+            INT_TYPECODE, imap(operator.itemgetter(0), changes))
+        grouped_churn[author] = array(
+            INT_TYPECODE, imap(operator.itemgetter(1), changes))
+    return grouped_commits, grouped_churn
+
+
+def merge_grouped_commits(grouped_commits, dedupe_forks=False):
+    """Merges commits of every contributor across many repositories.
+
+    :param grouped_commits: Iterable of dictionaries (one for every repository)
+                            mapping contributor names to arrays of commit
+                            timestamps, from the latest to the earliest
+    :param dedupe_forks: Whether commits with identical timestamps
+                         in different repositories should be treated
+                         as the same commits (e.g. in forks)
+    :return: Dictionary mapping contributor names to arrays of their commit
+             timestamps in all the repositories, from the latest to the earliest
+    """
+    arrays_by_author = {}
+    for grouped in grouped_commits:
+        for author, times in grouped.iteritems():
+            arrays_by_author.setdefault(author, []).append(times)
+
+    # the arrays are sorted already, so it's enough to merge them
+    # (in ascending order, as that's the only one heapq supports)
+    merged_commits = {}
+    for author, arrays in arrays_by_author.iteritems():
+        if len(arrays) == 1:
+            merged_commits[author] = arrays[0]
+            continue
+        if dedupe_forks:
+            merged = merge_fork_times(arrays)
+        else:
+            merged = array(INT_TYPECODE,
+                           heapq.merge(*imap(reversed, arrays)))
+        merged.reverse()
+        merged_commits[author] = merged
+    return merged_commits
+
+
+def merge_fork_times(arrays):
+    """Merges arrays of commit timestamps from many repositories,
+    keeping every timestamp as many times as it occurs
+    in any single repository.
+
+    :return: Array of timestamps, from the earliest to the latest
+    """
+    times = heapq.merge(*(izip(reversed(arr), repeat(i))
+                          for i, arr in enumerate(arrays)))
+    merged = array(INT_TYPECODE)
+    for time, group in groupby(times, key=operator.itemgetter(0)):
+        # tuples with the same timestamp are ordered by repository
+        copies = max(len(list(commits)) for _, commits
+                     in groupby(group, key=operator.itemgetter(1)))
+        merged.extend(repeat(time, copies))
+    return merged
 
 
 def cluster_commits(grouped_commits, cluster_algo, epsilon):
     """Clusters commits for every contributor in given dictionary.
 
     :param grouped_commits: Dictionary mapping contributor names
-                            to lists of Commit tuples
+                            to arrays of commit timestamps
     :param cluster_algo: Name of clustering algorithm
     :param epsilon: Temporal distance for the epsilon-neighborhood
 
-    :return: Dictionary mapping author names to lists of coding sessions
+    :return: Dictionary mapping author names to Clusters of their commits
     """
     cluster_func = globals().get(cluster_algo + '_clustering')
     if not cluster_func:
         raise ValueError("Unknown clustering algorithm '%s'" % cluster_algo)
 
-    return dicts.mapvalues(curry(cluster_func, epsilon=epsilon),
-                           grouped_commits)
+    return dict((author, cluster_func(times, epsilon))
+                for author, times in grouped_commits.iteritems())
 
 
 ## Algorithms
 
-def simple_clustering(commits, epsilon):
-    """Divides list of commits into clusters (coding sessions)
+def simple_clustering(times, epsilon):
+    """Divides commits into clusters (coding sessions)
     using simple clustering.
 
+    :param times: Array of commit timestamps, from the latest to the earliest
     :param epsilon: Maximum time interval between commit in single session
-    :return: List of lists of Commit tuples
+    :return: Clusters tuple
     """
-    sessions = []
-
-    session = []
-    last_commit_time = None  # pacify linter
-    for commit in commits:
-        # if interval between commits is too long, assume end of session
-        if session and last_commit_time - commit.time > epsilon:
-            sessions.append(session)
-            session = []
-        session.append(commit)
-        last_commit_time = commit.time
-    else:
-        if session:
-            sessions.append(session)
-
-    return sessions
+    max_gap = epsilon.total_seconds()
+
+    # if interval between commits is too long, assume end of session
+    gaps = imap(operator.sub, times, islice(times, 1, None))
+    bounds = array(INT_TYPECODE, [0])
+    bounds.extend(compress(count(1), imap(operator.lt, repeat(max_gap), gaps)))
+    if times:
+        bounds.append(len(times))
+
+    return Clusters(times, bounds)
@@ -0,0 +1,470 @@
+"""
+Reading commits directly from Git object database,
+without the need for ``git`` binary.
+"""
+from binascii import hexlify, unhexlify
+import heapq
+from itertools import chain
+import mmap
+import os
+import struct
+import zlib
+
+
+#: Types of objects stored in packfiles
+OBJ_COMMIT, OBJ_TAG, OBJ_OFS_DELTA, OBJ_REF_DELTA = 1, 4, 6, 7
+
+#: Size of chunks that compressed object data is inflated in
+INFLATE_CHUNK_SIZE = 4096
+
+#: Number of commits that the walk goes on for after only ancestors
+#: of excluded commits are left, in case of clock skew (like in Git)
+WALK_SLOP = 5
+
+
+class GitObjectError(Exception):
+    """Exception signaling problems with reading Git objects."""
+
+
+class Repository(object):
+    """Git repository that's read directly from its ``.git`` directory.
+
+    Packfiles (and their indices) are memory-mapped and their objects
+    are only inflated when they are actually requested.
+    """
+    def __init__(self, path):
+        git_dir = os.path.join(path, '.git')
+        if os.path.isfile(git_dir):
+            # working trees of submodules etc. point to the actual .git dir
+            with open(git_dir) as f:
+                git_dir = os.path.join(path, f.read().split(':', 1)[1].strip())
+
+        common_dir_file = os.path.join(git_dir, 'commondir')
+        if os.path.isfile(common_dir_file):
+            with open(common_dir_file) as f:
+                common_dir = os.path.join(git_dir, f.read().strip())
+        else:
+            common_dir = git_dir
+
+        self.git_dir = git_dir
+        self.common_dir = common_dir
+        self.objects_dir = os.path.join(common_dir, 'objects')
+        self._packs = None
+
+    @property
+    def packs(self):
+        if self._packs is None:
+            pack_dir = os.path.join(self.objects_dir, 'pack')
+            names = os.listdir(pack_dir) if os.path.isdir(pack_dir) else []
+            self._packs = [Pack(os.path.join(pack_dir, name[:-len('.idx')]))
+                           for name in sorted(names) if name.endswith('.idx')]
+        return self._packs
+
+    def close(self):
+        for pack in self._packs or ():
+            pack.close()
+        self._packs = None
+
+    # Refs
+
+    def resolve_ref(self, name='HEAD'):
+        """Resolves given ref (e.g. ``'HEAD'``) to binary SHA of a commit.
+        :return: Binary SHA, or None if the ref doesn't exist (yet)
+        """
+        for _ in xrange(0, 10):  # limit the depth of symbolic refs
+            for ref_dir in (self.git_dir, self.common_dir):
+                ref_path = os.path.join(ref_dir, name)
+                if os.path.isfile(ref_path):
+                    with open(ref_path) as f:
+                        value = f.read().strip()
+                    break
+            else:
+                value = self.packed_refs().get(name)
+                if value is None:
+                    return None
+
+            if not value.startswith('ref:'):
+                return unhexlify(value)
+            name = value[len('ref:'):].strip()
+
+        raise GitObjectError("Too deeply nested symbolic ref '%s'" % name)
+
+    def find_ref(self, name):
+        """Resolves given ref, which may be abbreviated (e.g. ``'master'``
+        rather than ``'refs/heads/master'``), the same way Git does.
+        :return: Binary SHA, or None if no such ref exists
+        """
+        for pattern in REF_PATTERNS:
+            sha = self.resolve_ref(pattern % name)
+            if sha:
+                return sha
+
+    def list_refs(self, prefix='refs/'):
+        """Returns a dictionary of all refs with given prefix,
+        mapping their full names to binary SHAs.
+        """
+        refs = dict((name, unhexlify(sha))
+                    for name, sha in self.packed_refs().iteritems()
+                    if name.startswith(prefix))
+
+        # loose refs take precedence over packed ones
+        ref_dir = os.path.join(self.common_dir, prefix)
+        for dirpath, _, filenames in os.walk(ref_dir):
+            for filename in filenames:
+                name = os.path.relpath(os.path.join(dirpath, filename),
+                                       self.common_dir)
+                name = name.replace(os.sep, '/')
+                sha = self.resolve_ref(name)
+                if sha:
+                    refs[name] = sha
+        return refs
+
+    def packed_refs(self):
+        """Returns a dictionary of refs from the ``packed-refs`` file. """
+        refs = {}
+        packed_refs_path = os.path.join(self.common_dir, 'packed-refs')
+        if os.path.isfile(packed_refs_path):
+            with open(packed_refs_path) as f:
+                for line in f:
+                    if line.startswith(('#', '^')):
+                        continue
+                    sha, name = line.split()
+                    refs[name] = sha
+        return refs
+
+    def shallow_commits(self):
+        """Returns the set of binary SHAs of commits
+        whose parents are missing from the (shallow) repository.
+        """
+        shallow_path = os.path.join(self.common_dir, 'shallow')
+        if not os.path.isfile(shallow_path):
+            return set()
+        with open(shallow_path) as f:
+            return set(unhexlify(line.strip()) for line in f if line.strip())
+
+    # Objects
+
+    def read_object(self, sha):
+        """Reads the object with given binary SHA.
+        :return: Tuple of object type and its data
+        """
+        for pack in self.packs:
+            offset = pack.find(sha)
+            if offset is not None:
+                return pack.read_object(offset, self)
+
+        loose_path = os.path.join(self.objects_dir,
+                                  hexlify(sha[:1]), hexlify(sha[1:]))
+        try:
+            with open(loose_path, 'rb') as f:
+                raw = zlib.decompress(f.read())
+        except IOError:
+            raise GitObjectError("Object %s not found" % hexlify(sha))
+
+        header, _, data = raw.partition('\0')
+        type_name = header.split(' ', 1)[0]
+        return OBJECT_TYPES.get(type_name), data
+
+    def peel(self, sha):
+        """Follows annotated tags, starting from object with given SHA.
+        :return: Tuple of the binary SHA and type of the first object
+                 that isn't a tag
+        """
+        for _ in xrange(0, 10):  # limit the depth of tags pointing to tags
+            obj_type, data = self.read_object(sha)
+            if obj_type != OBJ_TAG:
+                return sha, obj_type
+            object_line = data[:data.index('\n')]
+            sha = unhexlify(object_line[len('object '):])
+
+        raise GitObjectError("Too deeply nested tag %s" % hexlify(sha))
+
+    def read_commit(self, sha):
+        """Reads the commit with given binary SHA.
+        :return: CommitObject
+        """
+        obj_type, data = self.read_object(sha)
+        if obj_type != OBJ_COMMIT:
+            raise GitObjectError("Object %s is not a commit" % hexlify(sha))
+        return parse_commit(data)
+
+    def walk_commits(self, start_shas, exclude_shas=()):
+        """Walks the commit graph from given starting commits,
+        visiting each commit exactly once, the most recently committed first.
+
+        Like ``git rev-list``, the walk marks ancestors of excluded commits
+        as it goes, and ends once only they are left to visit
+        (rather than going through all of them).
+
+        :param exclude_shas: Commits which (along with their ancestors)
+                             should not be visited
+        :return: Iterable of (binary SHA, CommitObject) pairs
+        """
+        shallow = self.shallow_commits()
+        excluded = set(exclude_shas)
+        queue = []  # heap of (negated commit time, SHA, CommitObject)
+        seen = set()
+        for sha in chain(exclude_shas, start_shas):
+            if sha not in seen:
+                seen.add(sha)
+                commit = self.read_commit(sha)
+                heapq.heappush(queue, (-commit.commit_time, sha, commit))
+
+        # without excluded commits, there is nothing to wait for
+        # before yielding the visited ones
+        pending = [] if excluded else None
+        parents = {}  # of visited commits, to exclude their ancestors later
+        slop = WALK_SLOP
+        while queue:
+            _, sha, commit = heapq.heappop(queue)
+            if sha not in shallow:
+                parents[sha] = commit.parents
+                for parent in commit.parents:
+                    if sha in excluded:
+                        self._exclude(parent, excluded, parents)
+                    if parent not in seen:
+                        seen.add(parent)
+                        parent_commit = self.read_commit(parent)
+                        heapq.heappush(queue, (-parent_commit.commit_time,
+                                               parent, parent_commit))
+            if sha not in excluded:
+                if pending is None:
+                    yield sha, commit
+                else:
+                    pending.append((sha, commit))
+
+            if pending is not None:
+                if all(item[1] in excluded for item in queue):
+                    slop -= 1
+                    if not slop:
+                        break
+                else:
+                    slop = WALK_SLOP
+
+        for sha, commit in pending or ():
+            if sha not in excluded:  # ancestor of commit visited later
+                yield sha, commit
+
+    def _exclude(self, sha, excluded, parents):
+        """Marks given commit as excluded, along with its ancestors
+        that have already been visited.
+        """
+        stack = [sha]
+        while stack:
+            sha = stack.pop()
+            if sha not in excluded:
+                excluded.add(sha)
+                stack.extend(parents.get(sha, ()))
+
+
+class Pack(object):
+    """A single packfile, along with its (version 2) index."""
+
+    def __init__(self, basename):
+        self.basename = basename
+        self._idx = self._pack = None
+        self._files = []
+
+    def _map(self, path):
+        f = open(path, 'rb')
+        self._files.append(f)
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def idx(self):
+        if self._idx is None:
+            idx = self._map(self.basename + '.idx')
+            if idx[:8] != '\377tOc\0\0\0\2':
+                raise GitObjectError("Unsupported pack index format: %s.idx"
+                                     % self.basename)
+            self._idx = idx
+            self.count = struct.unpack_from('>I', idx, 8 + 255 * 4)[0]
+        return self._idx
+
+    @property
+    def pack(self):
+        if self._pack is None:
+            self._pack = self._map(self.basename + '.pack')
+        return self._pack
+
+    def close(self):
+        for mapping in (self._idx, self._pack):
+            if mapping is not None:
+                mapping.close()
+        for f in self._files:
+            f.close()
+        self._idx = self._pack = None
+        self._files = []
+
+    def find(self, sha):
+        """Finds the object with given binary SHA in the pack.
+        :return: Offset of the object in packfile, or None
+        """
+        idx = self.idx
+        fanout = 8
+        first_byte = ord(sha[0])
+        lo = (struct.unpack_from('>I', idx, fanout + (first_byte - 1) * 4)[0]
+              if first_byte else 0)
+        hi = struct.unpack_from('>I', idx, fanout + first_byte * 4)[0]
+
+        names = fanout + 256 * 4
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name = idx[names + mid * 20:names + (mid + 1) * 20]
+            if name < sha:
+                lo = mid + 1
+            elif name > sha:
+                hi = mid
+            else:
+                return self._offset(mid)
+
+    def _offset(self, index):
+        idx, count = self.idx, self.count
+        offsets = 8 + 256 * 4 + count * 20 + count * 4
+        offset = struct.unpack_from('>I', idx, offsets + index * 4)[0]
+        if offset & 0x80000000:
+            large_offsets = offsets + count * 4
+            large_index = offset & 0x7fffffff
+            offset = struct.unpack_from('>Q', idx,
+                                        large_offsets + large_index * 8)[0]
+        return offset
+
+    def read_object(self, offset, repo):
+        """Reads the object at given offset, resolving any deltas.
+
+        :param repo: Repository that bases of REF_DELTA objects are read from
+        :return: Tuple of object type and its data
+        """
+        pack = self.pack
+        start = offset
+
+        c = ord(pack[offset]) ; offset += 1
+        obj_type = (c >> 4) & 7
+        size, shift = c & 15, 4
+        while c & 0x80:
+            c = ord(pack[offset]) ; offset += 1
+            size |= (c & 0x7f) << shift
+            shift += 7
+
+        if obj_type == OBJ_OFS_DELTA:
+            c = ord(pack[offset]) ; offset += 1
+            base_distance = c & 0x7f
+            while c & 0x80:
+                c = ord(pack[offset]) ; offset += 1
+                base_distance = ((base_distance + 1) << 7) | (c & 0x7f)
+            obj_type, base = self.read_object(start - base_distance, repo)
+        elif obj_type == OBJ_REF_DELTA:
+            base_sha = pack[offset:offset + 20] ; offset += 20
+            obj_type, base = repo.read_object(base_sha)
+        else:
+            return obj_type, inflate(pack, offset, size)
+
+        return obj_type, apply_delta(base, inflate(pack, offset, size))
+
+
+#: Patterns that abbreviated ref names are tried against, in order
+REF_PATTERNS = ['%s', 'refs/%s', 'refs/tags/%s', 'refs/heads/%s',
+                'refs/remotes/%s', 'refs/remotes/%s/HEAD']
+
+OBJECT_TYPES = {'commit': OBJ_COMMIT, 'tree': 2, 'blob': 3, 'tag': OBJ_TAG}
+
+
+def inflate(data, offset, size):
+    """Inflates zlib-compressed data starting at given offset.
+    :param size: Size of the uncompressed data
+    """
+    decompressor = zlib.decompressobj()
+    chunks = []
+    inflated = 0
+    while inflated < size:
+        chunk = data[offset:offset + INFLATE_CHUNK_SIZE]
+        if not chunk:
+            raise GitObjectError("Unexpected end of compressed data")
+        offset += INFLATE_CHUNK_SIZE
+
+        chunk = decompressor.decompress(chunk)
+        chunks.append(chunk)
+        inflated += len(chunk)
+    return ''.join(chunks)
+
+
+def apply_delta(base, delta):
+    """Reconstructs an object from its base and a delta against it. """
+    def varint(pos):
+        value = shift = 0
+        while True:
+            c = ord(delta[pos]) ; pos += 1
+            value |= (c & 0x7f) << shift
+            shift += 7
+            if not c & 0x80:
+                return value, pos
+
+    _, pos = varint(0)  # size of the base
+    _, pos = varint(pos)  # size of the result
+
+    result = []
+    while pos < len(delta):
+        op = ord(delta[pos]) ; pos += 1
+        if op & 0x80:
+            # copy a fragment of the base object
+            offset = size = 0
+            for i in xrange(0, 4):
+                if op & (1 << i):
+                    offset |= ord(delta[pos]) << (8 * i) ; pos += 1
+            for i in xrange(0, 3):
+                if op & (0x10 << i):
+                    size |= ord(delta[pos]) << (8 * i) ; pos += 1
+            result.append(base[offset:offset + (size or 0x10000)])
+        elif op:
+            # insert new data
+            result.append(delta[pos:pos + op]) ; pos += op
+        else:
+            raise GitObjectError("Invalid delta opcode")
+
+    return ''.join(result)
+
+
+# Commits
+
+class CommitObject(object):
+    """Fields of Git commit object that are relevant for coded4.
+
+    ``time`` is the author time, while ``commit_time`` is the committer time
+    (which commits are ordered by when walking the history).
+    """
+    __slots__ = ('parents', 'author', 'time', 'commit_time', 'message')
+
+    def __init__(self, parents, author, time, commit_time, message):
+        self.parents = parents
+        self.author = author
+        self.time = time
+        self.commit_time = commit_time
+        self.message = message
+
+
+def parse_commit(data):
+    """Parses the raw data of commit object.
+    :return: CommitObject
+    """
+    header, _, message = data.partition('\n\n')
+
+    parents = []
+    author_line = committer_line = ''
+    for line in header.split('\n'):
+        if line.startswith('parent '):
+            parents.append(unhexlify(line[7:47]))
+        elif line.startswith('author '):
+            author_line = line[7:]
+        elif line.startswith('committer '):
+            committer_line = line[10:]
+
+    # author line is: Name <e-mail> timestamp timezone
+    ident, timestamp, _ = author_line.rsplit(' ', 2)
+    author = ident.rsplit(' <', 1)[0]
+    commit_timestamp = committer_line.rsplit(' ', 2)[-2]
+
+    # like Git's %s, the subject is the first paragraph of message
+    subject = ' '.join(message.split('\n\n', 1)[0].split('\n')).strip()
+
+    return CommitObject(parents, author, int(timestamp),
+                        int(commit_timestamp), subject)
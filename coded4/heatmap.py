@@ -0,0 +1,110 @@
+"""
+Heatmaps of coding time by weekday and hour of day.
+"""
+from collections import OrderedDict
+from datetime import timedelta
+from itertools import imap, izip, repeat
+import operator
+import time
+
+
+DAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+HOURS = ['h%02d' % hour for hour in xrange(24)]
+
+HOUR = 3600
+WEEK = 7 * 24 * HOUR
+SLOTS = 7 * 24
+
+
+def heatmap_coding_sessions(coding_sessions):
+    """Splits coding time of every contributor into hours of the week.
+
+    Sessions (including approximated time before their first
+    and after last commit) have their time spread over all the hours
+    they cover, in local time as of their beginning (so the rare sessions
+    spanning a change of daylight saving time are off by an hour).
+
+    :param coding_sessions: Dictionary mapping contributor names
+                            to lists of coding Sessions
+
+    :return: List of output dictionaries, seven for every contributor
+             (one for every weekday), with coding time in every hour
+    """
+    heatmaps = [(name, week_heatmap(sessions))
+                for name, sessions in coding_sessions.iteritems()]
+    heatmaps.sort(key=lambda (_, heatmap): sum(heatmap), reverse=True)
+
+    rows = []
+    for name, heatmap in heatmaps:
+        for day, start in izip(DAYS, xrange(0, SLOTS, 24)):
+            row = OrderedDict([('name', name), ('day', day)])
+            for hour, seconds in izip(HOURS, heatmap[start:start + 24]):
+                row[hour] = timedelta(seconds=int(round(seconds)))
+            rows.append(row)
+    return rows
+
+
+def heatmap_totals(rows):
+    """Calculates aggregate totals of rows returned by
+    :func:`heatmap_coding_sessions`, for every hour of day.
+
+    :return: Output dictionary with totals, or None
+    """
+    if not rows:
+        return
+    totals = OrderedDict([('name', "TOTAL"), ('day', "all")])
+    for hour in HOURS:
+        totals[hour] = sum((row[hour] for row in rows), timedelta())
+    return totals
+
+
+def week_heatmap(sessions):
+    """Calculates coding time of a single contributor
+    in every hour of the week.
+
+    Every session is handled in constant time, no matter how many hours
+    it covers: only the hours where it starts and ends are updated,
+    in arrays of differences which are then summed up for the whole week.
+
+    :param sessions: List of coding Sessions
+    :return: List of seconds in every hour of the week,
+             starting with midnight on Monday (in local time)
+    """
+    starts = map(operator.sub, (s.start for s in sessions),
+                 (s.time_before_first for s in sessions))
+    lengths = [s.total_time for s in sessions]
+
+    # sessions that last for whole weeks add that many hours to every slot;
+    # the rest of them begins within the first week and ends before
+    # the end of the second, which is then folded onto the first
+    weeks, rests = zip(*imap(divmod, lengths, repeat(WEEK))) or ((), ())
+    begins = map(week_offset, starts)
+    ends = map(operator.add, begins, rests)
+
+    # for a boundary of session in given slot: partial time it adds
+    # (or subtracts) in that slot, and the change of number of ongoing
+    # sessions (which add a whole hour to every slot) in the following ones
+    partials = [0] * (2 * SLOTS + 1)
+    ongoing_changes = [0] * (2 * SLOTS + 1)
+    for offsets, sign in ((begins, 1), (ends, -1)):
+        for offset in offsets:
+            slot = int(offset // HOUR)
+            partials[slot] += sign * ((slot + 1) * HOUR - offset)
+            ongoing_changes[slot + 1] += sign
+
+    heatmap = [sum(weeks) * HOUR] * SLOTS
+    ongoing = 0
+    for slot in xrange(2 * SLOTS):
+        ongoing += ongoing_changes[slot]
+        heatmap[slot % SLOTS] += partials[slot] + ongoing * HOUR
+    return heatmap
+
+
+def week_offset(timestamp):
+    """Returns the number of seconds since the beginning of the week
+    (midnight on Monday) in local time, for given timestamp.
+    """
+    seconds = int(timestamp)  # approximated times may have fractions
+    t = time.localtime(seconds)
+    return (((t.tm_wday * 24 + t.tm_hour) * 60 + t.tm_min) * 60 + t.tm_sec +
+            timestamp - seconds)
@@ -0,0 +1,114 @@
+"""
+Talking to Mercurial's command server, so that a single ``hg`` process
+can answer many queries about a repository.
+"""
+import atexit
+import os
+import struct
+from subprocess import CalledProcessError, Popen, PIPE
+import threading
+
+
+class CommandServerError(Exception):
+    """Exception signaling problems with Mercurial command server."""
+
+
+class CommandServer(object):
+    """Mercurial command server (``hg serve --cmdserver pipe``)
+    running for a particular repository.
+    """
+    def __init__(self, path):
+        env = dict(os.environ, HGPLAIN='1')
+        self.path = path
+        self.process = Popen(['hg', 'serve', '--cmdserver', 'pipe'],
+                             cwd=path, env=env, stdin=PIPE, stdout=PIPE)
+        self.lock = threading.Lock()
+
+        channel, hello = self._read_channel()
+        if channel != 'o' or 'runcommand' not in hello:
+            raise CommandServerError(
+                "Unexpected hello message from command server: %r" % hello)
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+    def run_command(self, args):
+        """Runs given hg command (without the ``hg`` itself),
+        yielding chunks of its output as they arrive.
+
+        Anything the command writes to stderr is discarded.
+
+        :raise CalledProcessError: When the command exits with non-zero
+                                   status (after all of its output
+                                   has been read)
+        """
+        with self.lock:
+            data = '\0'.join(args)
+            self.process.stdin.write('runcommand\n')
+            self.process.stdin.write(struct.pack('>I', len(data)) + data)
+            self.process.stdin.flush()
+
+            finished = False
+            try:
+                while True:
+                    channel, data = self._read_channel()
+                    if channel == 'o':
+                        yield data
+                    elif channel == 'r':
+                        finished = True
+                        returncode = struct.unpack('>i', data)[0]
+                        break
+                    elif channel in 'IL':
+                        # command wants input that we don't have
+                        self.process.stdin.write(struct.pack('>I', 0))
+                        self.process.stdin.flush()
+                    elif channel.isupper():
+                        raise CommandServerError(
+                            "Unsupported required channel '%s'" % channel)
+            finally:
+                # if the output was abandoned midway, skip the rest of it,
+                # so that the server is ready for next command
+                while not finished:
+                    channel, _ = self._read_channel()
+                    finished = channel == 'r'
+
+        if returncode:
+            raise CalledProcessError(returncode, ['hg'] + list(args))
+
+    def _read_channel(self):
+        header = self.process.stdout.read(5)
+        if len(header) < 5:
+            raise CommandServerError("Command server has terminated")
+
+        channel, length = struct.unpack('>cI', header)
+        if channel in 'IL':
+            return channel, length  # input requests have no data
+        return channel, self.process.stdout.read(length)
+
+
+#: Running command servers, keyed by absolute path to repository
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def get_server(path):
+    """Returns the command server for repository at given path,
+    starting it if necessary.
+    """
+    path = os.path.abspath(path)
+    with _servers_lock:
+        server = _servers.get(path)
+        if server is None or server.process.poll() is not None:
+            server = _servers[path] = CommandServer(path)
+        return server
+
+
+@atexit.register
+def shutdown_servers():
+    """Terminates all the running command servers."""
+    with _servers_lock:
+        for server in _servers.itervalues():
+            server.close()
+        _servers.clear()
@@ -0,0 +1,87 @@
+"""
+Compact, columnar storage of commit history.
+"""
+from array import array
+from itertools import izip
+
+from coded4.vcs import Commit
+
+
+#: Typecode of arrays holding timestamps & other integers (64-bit on most
+#: platforms that matter)
+INT_TYPECODE = 'l'
+
+
+class CommitHistory(object):
+    """Commit history stored as columns rather than individual Commit tuples.
+
+    Commit timestamps (in seconds since epoch) and authors are kept
+    in parallel arrays, with author names interned into a table
+    and referred to by their integer codes. Hashes and messages
+    are only stored if explicitly requested.
+    """
+    def __init__(self, commits=(), keep_details=False):
+        """Constructor.
+
+        :param commits: Iterable of Commit tuples to fill the history with
+        :param keep_details: Whether commit hashes & messages should be kept
+        """
+        self.times = array(INT_TYPECODE)
+        self.author_codes = array(INT_TYPECODE)
+        self.authors = []
+        self._codes_by_author = {}
+
+        self.hashes = [] if keep_details else None
+        self.messages = [] if keep_details else None
+
+        self.extend(commits)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        """Iterates over the history as Commit tuples."""
+        authors = self.authors
+        hashes = self.hashes or [None] * len(self)
+        messages = self.messages or [None] * len(self)
+        for hash_, time, code, message in izip(hashes, self.times,
+                                               self.author_codes, messages):
+            yield Commit(hash_, time, authors[code], message)
+
+    def author_code(self, author):
+        """Returns the code of given author, interning their name if needed."""
+        code = self._codes_by_author.get(author)
+        if code is None:
+            code = self._codes_by_author[author] = len(self.authors)
+            self.authors.append(author)
+        return code
+
+    def append(self, commit):
+        """Adds a single Commit tuple to the history."""
+        self.times.append(commit.time)
+        self.author_codes.append(self.author_code(commit.author))
+        if self.hashes is not None:
+            self.hashes.append(commit.hash)
+            self.messages.append(commit.message)
+
+    def extend(self, commits):
+        """Adds Commit tuples from given iterable to the history."""
+        append = self.append
+        for commit in commits:
+            append(commit)
+
+    def group_by_authors(self):
+        """Splits the commit timestamps by their authors.
+
+        :return: Dictionary mapping author names to arrays of their
+                 commit timestamps, sorted from the latest to the earliest
+        """
+        columns = [array(INT_TYPECODE) for _ in self.authors]
+        appends = [column.append for column in columns]
+        for time, code in izip(self.times, self.author_codes):
+            appends[code](time)
+
+        # VCS output is usually in (almost) reverse chronological order
+        # already, which makes sorting it a linear operation in most cases
+        return dict((author, array(INT_TYPECODE, sorted(column, reverse=True)))
+                    for author, column in izip(self.authors, columns))
@@ -0,0 +1,92 @@
+"""
+Index of coding sessions, for answering date range queries.
+"""
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from coded4.utils import to_timestamp
+
+
+class RangeStats(namedtuple('RangeStats',
+                            ['name', 'sessions', 'commits', 'time'])):
+    """Statistics of a single contributor within a date range.
+
+    :param sessions: Number of sessions
+    :param commits: Number of commits
+    :param time: Total coding time, as timedelta
+    """
+
+
+class SessionIndex(object):
+    """Index of coding sessions of all contributors.
+
+    Built once from the full list of sessions, it answers queries
+    about any date range in logarithmic time.
+    """
+    def __init__(self, coding_sessions):
+        """Constructor.
+        :param coding_sessions: Dictionary mapping contributor names
+                                to lists of coding Sessions
+        """
+        self.contributors = dict(
+            (name, ContributorIndex(sessions))
+            for name, sessions in coding_sessions.iteritems())
+
+    def query(self, since=None, until=None):
+        """Calculates statistics of every contributor within a date range.
+
+        Only whole sessions are taken into account: those whose first commit
+        was made after ``since`` and last commit before ``until``.
+
+        :param since: Start of the range, as datetime or timestamp (optional)
+        :param until: End of the range, as datetime or timestamp (optional)
+        :return: List of RangeStats tuples for contributors which have
+                 any sessions in the range
+        """
+        since, until = [to_timestamp(t) if isinstance(t, datetime) else t
+                        for t in (since, until)]
+
+        result = []
+        for name, index in self.contributors.iteritems():
+            stats = index.query(since, until)
+            if stats[0]:
+                result.append(RangeStats(name, *stats))
+        return result
+
+
+class ContributorIndex(object):
+    """Index of coding sessions of a single contributor.
+
+    Sessions of a contributor don't overlap, so both their start
+    and end times are sorted, and any range of sessions can be summed up
+    from prefix sums of their commit counts and total times.
+    """
+    def __init__(self, sessions):
+        sessions = sorted(sessions, key=lambda s: s.start)
+
+        self.starts = [s.start for s in sessions]
+        self.ends = [s.end for s in sessions]
+
+        self.commit_sums = [0]
+        self.time_sums = [0]
+        for session in sessions:
+            self.commit_sums.append(self.commit_sums[-1] + session.commits)
+            self.time_sums.append(self.time_sums[-1] + session.total_time)
+
+    def query(self, since=None, until=None):
+        """Calculates statistics of sessions within given range.
+
+        :param since: Start of the range, as timestamp (optional)
+        :param until: End of the range, as timestamp (optional)
+        :return: Tuple of number of sessions, commits and total time
+        """
+        first = 0 if since is None else bisect_left(self.starts, since)
+        last = (len(self.ends) if until is None
+                else bisect_right(self.ends, until))
+        if last <= first:
+            return 0, 0, timedelta()
+
+        commits = self.commit_sums[last] - self.commit_sums[first]
+        seconds = self.time_sums[last] - self.time_sums[first]
+        return last - first, commits, timedelta(seconds=seconds)
@@ -4,213 +4,468 @@ Generating output in various formats.
 from __future__ import unicode_literals
 
 from collections import OrderedDict
-from copy import deepcopy
 from datetime import timedelta
+from itertools import chain, imap
 import os
 
-from taipan.collections import dicts
+from coded4.stats import QUANTILES, calculate_totals
 
-from coded4.stats import calculate_totals
 
+def write_output(out, repo_dir, contributors, output_format, path=None):
+    """Writes the output in specified format.
 
-def format_output(repo_dir, contributors, output_format):
-    """Formats the output in specified format.
-
+    :param out: File-like object to write the output to
     :param repo_dir: Path to directory with repo that had its statistics generated
     :param contributors: List of Contributor tuples
     :param output_format: Name of output format
+    :param path: Optional path within the repo that the statistics are for
+    """
+    if output_format == 'sessions':
+        # binary format with every session rather than aggregate statistics
+        from coded4.sessionfile import write_session_file
+        write_session_file(out, report_name(repo_dir, path), contributors)
+        return
+
+    contribs = OutputRows(to_output_dict, contributors)
+    totals = to_output_dict(calculate_totals(contributors))
+    write_rows(out, repo_dir, contribs, totals, output_format, path)
+
+
+def write_rows(out, repo_dir, rows, totals, output_format, path=None,
+               header=False):
+    """Writes arbitrary rows of statistics in specified format.
+
+    :param out: File-like object to write the output to
+    :param repo_dir: Path to directory with repo that had its statistics generated
+    :param rows: Iterable of output dictionaries, one for every contributor;
+                 the ``table`` format iterates over it twice
+    :param totals: Output dictionary with aggregate totals,
+                   or None if there are no rows to total
+    :param output_format: Name of output format
+    :param path: Optional path within the repo that the statistics are for,
+                 appended to repo's name
+    :param header: Whether CSV output should start with a row of column
+                   names, for rows whose columns depend on the statistics
     """
     output_func = globals().get('output_' + output_format)
     if not output_func:
         raise ValueError(
             "Unknown or unsupported output format '%s'" % output_format)
+    if header and output_func is output_csv:
+        output_func = output_csv_with_header
 
-    repo_name = os.path.basename(repo_dir)
-    contribs = map(to_output_dict, contributors)
-    totals = to_output_dict(calculate_totals(contributors))
-    return output_func(repo_name, contribs, totals)
+    if totals is None:
+        totals = OrderedDict([('name', "TOTAL")])
+    output_func(out, report_name(repo_dir, path), rows, totals)
+
+
+def write_batch_output(out, repos, output_format):
+    """Writes the output for many repositories,
+    as a single document in specified format.
+
+    :param out: File-like object to write the output to
+    :param repos: Iterable of pairs: path to directory with repo
+                  and list of its Contributor tuples
+    :param output_format: Name of output format
+    """
+    write_reports(out, ((report_name(repo_dir), contributors)
+                        for repo_dir, contributors in repos), output_format)
+
+
+def write_path_output(out, repo_dir, paths, output_format):
+    """Writes the output for many paths within a repository,
+    as a single document in specified format.
+
+    :param out: File-like object to write the output to
+    :param repo_dir: Path to directory with repo
+    :param paths: Iterable of pairs: path within the repo
+                  and list of Contributor tuples for it
+    :param output_format: Name of output format
+    """
+    write_reports(out, ((report_name(repo_dir, path), contributors)
+                        for path, contributors in paths), output_format)
+
+
+def write_reports(out, reports, output_format):
+    """Writes many reports as a single document in specified format,
+    e.g. a JSON list or an XML document with ``<batch>`` root.
+
+    :param out: File-like object to write the output to
+    :param reports: Iterable of pairs: name of the report
+                    and list of Contributor tuples
+    :param output_format: Name of output format
+    """
+    output_func = globals().get('output_batch_' + output_format)
+    if not output_func:
+        raise ValueError(
+            "Unknown or unsupported output format '%s'" % output_format)
+
+    output_func(out, ((name, OutputRows(to_output_dict, contributors),
+                       to_output_dict(calculate_totals(contributors)))
+                      for name, contributors in reports))
+
+
+def format_output(repo_dir, contributors, output_format):
+    """Formats the output in specified format.
+    :return: Output as string
+    """
+    return format_with(write_output, repo_dir, contributors, output_format)
+
+
+def format_rows(repo_dir, rows, totals, output_format):
+    """Formats arbitrary rows of statistics in specified format.
+    :return: Output as string
+    """
+    return format_with(write_rows, repo_dir, rows, totals, output_format)
+
+
+def format_batch_output(repos, output_format):
+    """Formats the output for many repositories.
+    :return: Output as string
+    """
+    return format_with(write_batch_output, repos, output_format)
+
+
+def format_with(write_func, *args):
+    """Calls given writing function with an in-memory file,
+    returning everything it has written.
+    """
+    from StringIO import StringIO
+    result = StringIO()
+    write_func(result, *args)
+    return result.getvalue()
 
 
 def to_output_dict(contributor):
     """Converts Contributor tuple into output dictionary. """
     res = OrderedDict()
     res['name'] = contributor.name
-    res['sessions'] = len(contributor.sessions)
-    res['commits'] = sum(len(s.commits) for s in contributor.sessions)
+    res['sessions'] = contributor.session_count
+    res['commits'] = contributor.commit_count
     res['time'] = contributor.total_time
+
+    distributions = contributor.distributions
+    if distributions is not None:
+        seconds = lambda value: timedelta(seconds=int(round(value)))
+        for name, histogram, convert in [
+                ('time', distributions.lengths, seconds),
+                ('commits', distributions.commits, lambda n: int(round(n))),
+                ('gap', distributions.gaps, seconds)]:
+            for label, q in QUANTILES:
+                res['%s_%s' % (label, name)] = convert(histogram.quantile(q))
     return res
 
 
+class OutputRows(object):
+    """Output dictionaries computed on the fly from another sequence,
+    every time they are iterated over.
+    """
+    def __init__(self, func, items):
+        self.func = func
+        self.items = items
+
+    def __iter__(self):
+        return imap(self.func, self.items)
+
+
 # Formatting functions
 
 str_ = ''.__class__
 
 
-def output_table(repo_name, contribs, totals):
+def output_table(out, repo_name, contribs, totals):
     """Outputs the repository statistics as table. """
-    items = contribs + [totals]
-    if not items:
-        return ""
-
     to_str = (lambda obj: timedelta_to_str(obj)
                           if isinstance(obj, timedelta) else str(obj))
 
-    # do some calculations for cells' dimensions
-    labels = items[0].keys()
-    max_col_lens = [max(map(len, [to_str(item[key]) for item in items] + labels))
-                    for key in labels]
+    # do some calculations for cells' dimensions in a separate pass,
+    # so that no rows have to be kept around while they're written
+    labels = totals.keys()
+    max_col_lens = [max(map(len, labels))] * len(labels)
+    for item in chain(contribs, [totals]):
+        max_col_lens = [max(col_len, len(to_str(item[key])))
+                        for key, col_len in zip(labels, max_col_lens)]
     max_row_len = sum(max_col_lens) + (len(labels) - 1)
 
-    def make_row(cell_func):
-        return ' '.join(cell_func(label).ljust(col_len)
-                        for label, col_len in zip(labels, max_col_lens))
+    def write_row(cell_func):
+        out.write(os.linesep)
+        out.write(' '.join(cell_func(label).ljust(col_len)
+                           for label, col_len in zip(labels, max_col_lens)))
 
-    lines = ["Statistics for '%s'" % repo_name, '']
+    out.write("Statistics for '%s'" % repo_name)
+    out.write(os.linesep)
 
     # format header
-    lines.append(make_row(lambda label: label))
-    lines.append('-' * max_row_len)
+    write_row(lambda label: label)
+    out.write(os.linesep + '-' * max_row_len)
 
     # format rows with contributors' stats
     for c in contribs:
-        row = make_row(lambda key: to_str(c[key]))
-        lines.append(row)
+        write_row(lambda key: to_str(c[key]))
 
     # format footer with aggregate totals
-    lines.append('-' * max_row_len)
-    lines.append(make_row(lambda key: to_str(totals[key])))
+    out.write(os.linesep + '-' * max_row_len)
+    write_row(lambda key: to_str(totals[key]))
 
-    return os.linesep.join(lines)
+
+def output_batch_table(out, reports):
+    """Outputs statistics of many repositories as tables,
+    one after another.
+    """
+    for i, report in enumerate(reports):
+        if i > 0:
+            out.write(os.linesep)
+        output_table(out, *report)
 
 
-def output_csv(repo_name, contribs, totals):
+def output_csv(out, repo_name, contribs, totals):
     """Outputs the repository statistics in CSV format."""
+    write_csv_rows(csv_writer(out), contribs, totals)
+
+
+def output_csv_with_header(out, repo_name, contribs, totals):
+    """Outputs the repository statistics in CSV format,
+    preceded by a row with names of the columns.
+    """
+    writer = csv_writer(out)
+    writer.writerow(map(utf8, totals.keys()))
+    write_csv_rows(writer, contribs, totals)
+
+
+def output_batch_csv(out, reports):
+    """Outputs statistics of many repositories in CSV format,
+    with repository's name in the first column.
+    """
+    writer = csv_writer(out)
+    for repo_name, contribs, totals in reports:
+        write_csv_rows(writer, contribs, totals, prefix=[repo_name])
+
+
+def csv_writer(out):
+    """Creates CSV writer for given file-like object. """
     import csv
-    from StringIO import StringIO
+    return csv.writer(out, delimiter=utf8(','),
+                      quotechar=utf8('"'), quoting=csv.QUOTE_MINIMAL)
 
-    utf8 = lambda x: str_(x).encode('utf-8')
 
-    result = StringIO()
-    writer = csv.writer(result, delimiter=utf8(','),
-                        quotechar=utf8('"'), quoting=csv.QUOTE_MINIMAL)
+def write_csv_rows(writer, contribs, totals, prefix=()):
+    """Writes rows of statistics with given CSV writer.
+    :param prefix: Values of additional columns written before every row
+    """
+    prefix = map(utf8, prefix)
 
     def write_contrib(contrib):
         """Write a single contributor as CSV, handling Unicode encoding."""
-        contrib = contrib.copy()
-        for key in ('name', 'time'):
-            contrib[key] = utf8(contrib[key])
-        writer.writerow(contrib.values())
+        writer.writerow(prefix + [
+            utf8(value) if key == 'name' or isinstance(value, timedelta)
+            else value
+            for key, value in contrib.iteritems()])
 
     for contrib in contribs:
         write_contrib(contrib)
     write_contrib(totals)
 
-    result.seek(0)
-    return result.read()
 
-
-def output_json(repo_name, contribs, totals):
+def output_json(out, repo_name, contribs, totals):
     """Outputs the repository statistics in JSON format. """
     import json
-    return json.dumps(repo_dict(repo_name, contribs, totals),
-                      default=timedelta_to_str)
 
+    dump = lambda obj: json.dumps(obj, default=timedelta_to_str)
 
-def output_yaml(repo_name, contribs, totals):
+    totals = dict(item for item in totals.items() if item[0] != 'name')
+    out.write('{"repo": %s, "total": %s, "contributors": ['
+              % (dump(repo_name), dump(totals)))
+    for i, contrib in enumerate(contribs):
+        if i > 0:
+            out.write(', ')
+        out.write(dump(contrib))
+    out.write(']}')
+
+
+def output_batch_json(out, reports):
+    """Outputs statistics of many repositories as JSON list. """
+    out.write('[')
+    for i, report in enumerate(reports):
+        if i > 0:
+            out.write(', ')
+        output_json(out, *report)
+    out.write(']')
+
+
+def output_yaml(out, repo_name, contribs, totals):
     """Output the repository statistics in YAML format."""
-    from StringIO import StringIO
+    from taipan.collections import dicts
 
-    result = StringIO()
-    print >>result, "repo:", repo_name
+    print >>out, "repo:", repo_name
 
     def write_contrib(contrib, indent=0):
         prefix = "- "
         indent = " " * indent
         for key, value in contrib.items():
-            print >>result, indent + "%s%s: %s" % (prefix, key, value)
+            print >>out, indent + "%s%s: %s" % (prefix, key, value)
             prefix = "  "
 
-    print >>result, "contributors:"
+    print >>out, "contributors:"
     for contrib in contribs:
         write_contrib(contrib)
 
-    print >>result, "totals:"
+    print >>out, "totals:"
     write_contrib(dicts.omit(['name'], from_=totals))
 
-    result.seek(0)
-    return result.read()
+
+def output_batch_yaml(out, reports):
+    """Outputs statistics of many repositories as YAML list. """
+    for report in reports:
+        lines = format_with(output_yaml, *report).splitlines()
+        for i, line in enumerate(lines):
+            print >>out, ("- " if i == 0 else "  ") + line
 
 
-def output_plist(repo_name, contribs, totals):
+def output_plist(out, repo_name, contribs, totals):
     """Outputs the repository statistics in .plist format."""
-    import plistlib
+    out.write(PLIST_HEADER)
+    write_plist_statistics(out, repo_name, contribs, totals)
+    out.write('</plist>\n')
+
+
+def output_batch_plist(out, reports):
+    """Outputs statistics of many repositories as .plist array. """
+    out.write(PLIST_HEADER)
+    out.write('<array>\n')
+    for report in reports:
+        write_plist_statistics(out, *report, indent='\t')
+    out.write('</array>\n')
+    out.write('</plist>\n')
+
+
+def write_plist_statistics(out, repo_name, contribs, totals, indent=''):
+    """Writes the repository statistics as .plist dictionary. """
+    from xml.sax.saxutils import escape
+    from taipan.collections import dicts
+
+    def write_value(value, indent):
+        if isinstance(value, bool):
+            out.write('%s<%s/>\n' % (indent, str_(value).lower()))
+        elif isinstance(value, (int, long)):
+            out.write('%s<integer>%d</integer>\n' % (indent, value))
+        elif isinstance(value, float):
+            out.write('%s<real>%r</real>\n' % (indent, value))
+        else:
+            if isinstance(value, timedelta):
+                value = timedelta_to_str(value)
+            out.write('%s<string>%s</string>\n' % (indent, escape(value)))
+
+    def write_dict(d, indent):
+        out.write(indent + '<dict>\n')
+        for key in sorted(d):
+            out.write('%s\t<key>%s</key>\n' % (indent, escape(key)))
+            write_value(d[key], indent + '\t')
+        out.write(indent + '</dict>\n')
+
+    # keys of the top-level dictionary go in alphabetical order,
+    # same as for every other dictionary
+    out.write(indent + '<dict>\n')
+    out.write(indent + '\t<key>contributors</key>\n')
+    out.write(indent + '\t<array>\n')
+    for contrib in contribs:
+        write_dict(contrib, indent + '\t\t')
+    out.write(indent + '\t</array>\n')
+    out.write(indent + '\t<key>repo</key>\n')
+    write_value(repo_name, indent + '\t')
+    out.write(indent + '\t<key>total</key>\n')
+    write_dict(dicts.omit(['name'], from_=totals), indent + '\t')
+    out.write(indent + '</dict>\n')
+
+PLIST_HEADER = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" \
+"http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+"""
 
-    res = repo_dict(repo_name, contribs, totals)
-    for c in res['contributors'] + [res['total']]:
-        c['time'] = timedelta_to_str(c['time'])
 
-    return plistlib.writePlistToString(res)
+def output_xml(out, repo_name, contribs, totals):
+    """Outputs the repository statistics in general XML format."""
+    out.write(XML_DECLARATION.encode('utf-8'))
+    write_xml_statistics(out, repo_name, contribs, totals)
 
 
-def output_xml(repo_name, contribs, totals):
-    """Outputs the repository statistics in general XML format."""
-    from StringIO import StringIO
-    import xml.etree.ElementTree as ET
+def output_batch_xml(out, reports):
+    """Outputs statistics of many repositories as XML document
+    with ``<batch>`` root.
+    """
+    out.write(XML_DECLARATION.encode('utf-8'))
+    out.write('<batch>'.encode('utf-8'))
+    for report in reports:
+        write_xml_statistics(out, *report)
+    out.write('</batch>'.encode('utf-8'))
 
-    stats = ET.Element('statistics', attrib={'repo': repo_name})
+XML_DECLARATION = "<?xml version='1.0' encoding='utf-8'?>\n"
 
-    def write_contrib(contrib, parent, tag):
-        ET.SubElement(parent, tag, attrib=dicts.mapvalues(str_, contrib))
 
-    contributors = ET.SubElement(stats, 'contributors')
-    for contrib in contribs:
-        write_contrib(contrib, parent=contributors, tag='contributor')
-    write_contrib(dicts.omit(['name'], from_=totals),
-                  parent=stats, tag='totals')
+def write_xml_statistics(out, repo_name, contribs, totals):
+    """Writes the repository statistics as ``<statistics>`` XML element. """
+    from xml.sax.saxutils import escape
+    from taipan.collections import dicts
 
-    result = StringIO()
-    ET.ElementTree(stats).write(result, encoding='utf-8', xml_declaration=True)
+    write = lambda s: out.write(s.encode('utf-8'))
+    attribs = lambda d: ''.join(
+        ' %s="%s"' % (key, escape(str_(d[key]),
+                                  {'"': '&quot;', '\n': '&#10;'}))
+        for key in sorted(d))
+
+    write('<statistics%s>' % attribs({'repo': repo_name}))
 
-    result.seek(0)
-    return result.read()
+    write('<contributors')
+    empty = True
+    for contrib in contribs:
+        if empty:
+            write('>')
+            empty = False
+        write('<contributor%s />' % attribs(contrib))
+    write(' />' if empty else '</contributors>')
+
+    write('<totals%s />' % attribs(dicts.omit(['name'], from_=totals)))
+    write('</statistics>')
 
 
-def output_sexp(repo_name, contribs, totals):
+def output_sexp(out, repo_name, contribs, totals):
     """Output the repository statistics as an S-expression."""
-    from StringIO import StringIO
+    from taipan.collections import dicts
 
-    result = StringIO()
-    print >>result, '(repo "%s"' % repo_name
+    out.write('(repo "%s"' % repo_name)
 
     def write_contrib(contrib, tag, indent=0):
         indent = ' ' * indent
-        print >>result, indent +'(%s %s)' % (tag, ' '.join(
-            '(%s "%s")' % item for item in contrib.items()))
+        out.write(os.linesep + indent + '(%s %s)' % (tag, ' '.join(
+            '(%s "%s")' % item for item in contrib.items())))
 
     for contrib in contribs:
         write_contrib(contrib, tag='contributor', indent=1)
     write_contrib(dicts.omit(['name'], from_=totals), tag='totals', indent=1)
+    out.write(')')
 
-    # insert final closing parenthesis before the last newline
-    result.seek(-len(os.linesep), 1)
-    print >>result, ")"
 
-    result.seek(0)
-    return result.read()[:-len(os.linesep)]  # remove that last newline
+def output_batch_sexp(out, reports):
+    """Output statistics of many repositories as a single S-expression. """
+    out.write('(batch')
+    for report in reports:
+        out.write(os.linesep + ' ')
+        output_sexp(out, *report)
+    out.write(')')
 
 
 # Utilities
 
-def repo_dict(repo_name, contribs, totals):
-    """Return a dictionary of repo statistics,
-    suitable for certain formats such as JSON.
-    """
-    totals = dict(item for item in totals.items() if item[0] != 'name')
-    return {
-        'repo': repo_name,
-        'contributors': deepcopy(contribs),
-        'total': totals,
-    }
+utf8 = lambda x: str_(x).encode('utf-8')
+
+
+def report_name(repo_dir, path=None):
+    """Returns the name of repository (or path within it) used in output. """
+    name = os.path.basename(repo_dir)
+    if path:
+        name += '/' + path
+    return name
 
 
 def timedelta_to_str(td):
@@ -0,0 +1,71 @@
+"""
+Splitting commit history by directories within the repository.
+"""
+import os
+
+from coded4.history import CommitHistory
+
+
+def normalize_path(path):
+    """Normalizes path within the repository into the form used by VCS,
+    e.g. ``./services/api/`` into ``services/api``.
+
+    :return: Normalized path; empty string for repository's root
+    """
+    parts = path.replace(os.sep, '/').split('/')
+    return '/'.join(part for part in parts if part not in ('', '.'))
+
+
+def split_by_paths(path_history, prefixes):
+    """Splits commit history by path prefixes (directories),
+    in a single pass over it.
+
+    Every commit is added to the history of each prefix which contains
+    any of the paths it has changed. Repository's root (empty prefix)
+    gets all the commits, including those without any paths (e.g. merges).
+
+    :param path_history: Iterable of pairs of Commit tuples
+                         and lists of paths they have changed
+    :param prefixes: List of normalized path prefixes
+    :return: Dictionary mapping prefixes to CommitHistory objects
+    """
+    histories = dict((prefix, CommitHistory()) for prefix in prefixes)
+    match = PathTrie(prefixes).match
+    root = [''] if '' in histories else []
+
+    for commit, paths in path_history:
+        matched = set(root)
+        for path in paths:
+            matched.update(match(path))
+        for prefix in matched:
+            histories[prefix].append(commit)
+
+    return histories
+
+
+class PathTrie(object):
+    """Trie of path prefixes, finding all of them which contain given path
+    in time proportional to its depth (rather than the number of prefixes).
+    """
+    def __init__(self, prefixes):
+        """Constructor.
+        :param prefixes: Iterable of normalized path prefixes
+        """
+        self.root = {}
+        for prefix in prefixes:
+            node = self.root
+            for part in filter(None, prefix.split('/')):
+                node = node.setdefault(part, {})
+            node[None] = prefix  # marks the end of a prefix
+
+    def match(self, path):
+        """Yields prefixes which contain given path (or are equal to it)."""
+        node = self.root
+        if None in node:
+            yield node[None]
+        for part in path.split('/'):
+            node = node.get(part)
+            if node is None:
+                return
+            if None in node:
+                yield node[None]
@@ -0,0 +1,100 @@
+"""
+Instrumentation of the stages of statistics calculation.
+"""
+from collections import namedtuple
+import os
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None  # not available on Windows
+
+
+class Stage(namedtuple('Stage', ['name', 'wall_time', 'cpu_time',
+                                 'peak_rss', 'items'])):
+    """Measurements of a single stage.
+
+    :param wall_time: Elapsed time in seconds
+    :param cpu_time: CPU time in seconds, including that of any child
+                     processes which have finished during the stage
+    :param peak_rss: Peak resident set size of the process (in KB on Linux)
+                     after the stage, or None if unavailable
+    :param items: Number of items that the stage has produced
+    """
+
+
+class Timings(object):
+    """Collects measurements of calculation stages."""
+
+    enabled = True
+
+    def __init__(self):
+        self.stages = []
+
+    def measure(self, name, func, *args, **kwargs):
+        """Runs given function as a stage of calculation, measuring it.
+
+        :param count: Optional function returning the number of items
+                      in stage's result
+        :return: Result of the function
+        """
+        count = kwargs.pop('count', None)
+
+        start_wall, start_cpu = time.time(), cpu_time()
+        result = func(*args, **kwargs)
+        wall, cpu = time.time() - start_wall, cpu_time() - start_cpu
+
+        items = count(result) if count else None
+        self.stages.append(Stage(name, wall, cpu, peak_rss(), items))
+        return result
+
+    def format_report(self, title=None):
+        """Formats the measurements as human-readable table."""
+        lines = ["Timings for '%s'" % title, ''] if title else []
+
+        row = '%-14s %10s %10s %12s %10s'
+        lines.append(row % ('stage', 'wall', 'cpu', 'peak RSS', 'items'))
+        lines.append('-' * len(lines[-1]))
+        for stage in self.stages:
+            lines.append(row % (
+                stage.name,
+                '%.3fs' % stage.wall_time,
+                '%.3fs' % stage.cpu_time,
+                '-' if stage.peak_rss is None else '%d KB' % stage.peak_rss,
+                '-' if stage.items is None else stage.items))
+        lines.append('-' * len(lines[-1]))
+        lines.append(row % ('TOTAL',
+                            '%.3fs' % sum(s.wall_time for s in self.stages),
+                            '%.3fs' % sum(s.cpu_time for s in self.stages),
+                            '', ''))
+
+        return os.linesep.join(lines)
+
+
+class NullTimings(object):
+    """Stand-in for Timings which measures nothing."""
+
+    enabled = False
+
+    def measure(self, name, func, *args, **kwargs):
+        kwargs.pop('count', None)
+        return func(*args, **kwargs)
+
+
+NO_TIMINGS = NullTimings()
+
+
+# Utilities
+
+def cpu_time():
+    """Returns CPU time used by the process and its finished children. """
+    user, system, children_user, children_system, _ = os.times()
+    return user + system + children_user + children_system
+
+
+def peak_rss():
+    """Returns peak resident set size of the process in KB, if known. """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
@@ -0,0 +1,106 @@
+"""
+Rolling up coding time into calendar periods.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from coded4.utils import to_timestamp
+
+
+def rollup_coding_sessions(coding_sessions, period):
+    """Splits coding time of every contributor into calendar periods.
+
+    Sessions which span more than one period (e.g. past midnight)
+    have their time divided between those periods accordingly.
+
+    :param coding_sessions: Dictionary mapping contributor names
+                            to lists of coding Sessions
+    :param period: Name of calendar period: ``'day'``, ``'week'``
+                   or ``'month'`` (in local time)
+
+    :return: List of output dictionaries, one for every contributor,
+             with coding time in every period (e.g. ``time_2024-03-01``)
+             and in total
+    """
+    bucket_func = globals().get(period + '_bucket')
+    if not bucket_func:
+        raise ValueError("Unknown calendar period '%s'" % period)
+
+    # seconds spent by every contributor in every period
+    rollups = {}
+    labels = set()
+    for name, sessions in coding_sessions.iteritems():
+        rollup = rollups[name] = {}
+        for session in sessions:
+            start = session.start - session.time_before_first
+            end = session.end + session.time_after_last
+            for label, seconds in split_interval(start, end, bucket_func):
+                rollup[label] = rollup.get(label, 0) + seconds
+        labels.update(rollup)
+
+    labels = sorted(labels)
+    rows = []
+    for name, rollup in rollups.iteritems():
+        row = OrderedDict(name=name)
+        for label in labels:
+            row['time_' + label] = timedelta(seconds=rollup.get(label, 0))
+        row['time'] = timedelta(seconds=sum(rollup.itervalues()))
+        rows.append(row)
+
+    return sorted(rows, key=lambda row: row['time'], reverse=True)
+
+
+def rollup_totals(rows):
+    """Calculates aggregate totals of rows returned by
+    :func:`rollup_coding_sessions`.
+
+    :return: Output dictionary with totals, or None
+    """
+    if not rows:
+        return
+    totals = OrderedDict(name="TOTAL")
+    for key in rows[0].keys()[1:]:
+        totals[key] = sum((row[key] for row in rows), timedelta())
+    return totals
+
+
+def split_interval(start, end, bucket_func):
+    """Splits time interval into calendar periods.
+
+    :param start: Start of the interval, in seconds since epoch
+    :param end: End of the interval, in seconds since epoch
+    :param bucket_func: Function returning label of the period that given
+                        local datetime falls into, and the start of next one
+
+    :return: Iterable of (period label, seconds) pairs
+    """
+    while True:
+        label, next_start = bucket_func(datetime.fromtimestamp(start))
+        next_start = to_timestamp(next_start)
+        if end <= next_start:
+            yield label, end - start
+            break
+        yield label, next_start - start
+        start = next_start
+
+
+## Periods
+
+def day_bucket(dt):
+    day = datetime(dt.year, dt.month, dt.day)
+    return day.strftime('%Y-%m-%d'), day + timedelta(days=1)
+
+
+def week_bucket(dt):
+    year, week, weekday = dt.isocalendar()
+    monday = datetime(dt.year, dt.month, dt.day) - timedelta(days=weekday - 1)
+    return '%04d-W%02d' % (year, week), monday + timedelta(weeks=1)
+
+
+def month_bucket(dt):
+    month = datetime(dt.year, dt.month, 1)
+    if dt.month == 12:
+        next_month = datetime(dt.year + 1, 1, 1)
+    else:
+        next_month = datetime(dt.year, dt.month + 1, 1)
+    return month.strftime('%Y-%m'), next_month
@@ -0,0 +1,307 @@
+"""
+Long-running server answering queries about statistics of repositories,
+which keeps their history and coding sessions in memory.
+"""
+from __future__ import unicode_literals
+
+import BaseHTTPServer
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import json
+import os
+from Queue import Queue
+import SocketServer
+import threading
+import time
+from urlparse import parse_qs, urlparse
+
+from coded4 import approx, cache, cluster, vcs
+from coded4.history import CommitHistory
+from coded4.index import SessionIndex
+from coded4.output import write_rows
+
+
+#: Formats accepted for ``since`` and ``until`` query parameters
+DATETIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d']
+
+#: Content types of the output formats
+CONTENT_TYPES = {
+    'table': 'text/plain',
+    'csv': 'text/csv',
+    'json': 'application/json',
+    'yaml': 'text/yaml',
+    'plist': 'application/x-plist',
+    'xml': 'application/xml',
+    'sexp': 'text/plain',
+}
+
+#: Default minimum number of seconds between checks
+#: whether a repository has changed
+DEFAULT_REFRESH_INTERVAL = 5
+
+#: Number of session indices (for distinct algorithms & epsilons)
+#: that are kept for every repository
+MAX_INDICES = 32
+
+
+class Repository(object):
+    """Repository whose commit history is kept in memory,
+    along with coding sessions calculated from it.
+    """
+    def __init__(self, directory, vcs_name=None, cache_dir=None,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 refs=None, merges=True):
+        """Constructor.
+
+        :param cache_dir: Optional directory of the on-disk history cache,
+                          used when (re)loading the whole history
+        :param refresh_interval: Minimum number of seconds between checks
+                                 whether the repository has changed
+        :param refs: Refs whose commits are retrieved,
+                     see :func:`coded4.vcs.retrieve_commit_history`
+        :param merges: Whether merge commits are retrieved
+        """
+        self.directory = directory
+        self.vcs_name = vcs_name or vcs.detect_vcs(directory)
+        self.cache_dir = cache_dir
+        self.refs = refs
+        self.merges = merges
+        self.refresh_interval = refresh_interval
+
+        self.lock = threading.Lock()
+        self.tip = None
+        self.history = None
+        self.grouped_commits = None
+        self.indices = OrderedDict()
+        self.last_refresh = 0
+
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """Reloads the history if repository's tip has changed.
+
+        If the previous tip is still part of the history, only commits
+        made after it are fetched.
+        """
+        now = time.time()
+        with self.lock:
+            if not force and now - self.last_refresh < self.refresh_interval:
+                return
+            self.last_refresh = now
+
+            tip = vcs.retrieve_tip(self.directory, self.vcs_name,
+                                   refs=self.refs)
+            if self.history is not None and tip == self.tip:
+                return
+
+            # history is retrieved up to the tip that's recorded,
+            # so that commits added in the meantime are fetched next time
+            selection = dict(refs=self.refs, merges=self.merges, tip=tip)
+
+            if self.tip and tip and vcs.contains_revision(
+                    self.directory, self.tip, self.vcs_name, refs=self.refs):
+                self.history.extend(vcs.retrieve_commit_history(
+                    self.directory, self.vcs_name, after_revision=self.tip,
+                    **selection))
+            elif self.cache_dir:
+                self.history = CommitHistory(cache.cached_commit_history(
+                    self.directory, self.vcs_name, cache_dir=self.cache_dir,
+                    **selection))
+            else:
+                self.history = CommitHistory(vcs.retrieve_commit_history(
+                    self.directory, self.vcs_name, **selection))
+
+            self.tip = tip
+            self.grouped_commits = self.history.group_by_authors()
+            self.indices.clear()
+
+    def session_index(self, cluster_algo, approx_algo, epsilon):
+        """Returns the SessionIndex of coding sessions calculated
+        with given algorithms and epsilon, computing it if necessary.
+        """
+        key = (cluster_algo, approx_algo, epsilon)
+        with self.lock:
+            index = self.indices.pop(key, None)
+            if index is None:
+                clustered = cluster.cluster_commits(
+                    self.grouped_commits, cluster_algo, epsilon)
+                coding_sessions = approx.approximate_coding_sessions(
+                    clustered, approx_algo)
+                index = SessionIndex(coding_sessions)
+                while len(self.indices) >= MAX_INDICES:
+                    self.indices.popitem(last=False)
+            self.indices[key] = index  # most recently used go last
+            return index
+
+    def query(self, cluster_algo, approx_algo, epsilon,
+              since=None, until=None):
+        """Calculates statistics of contributors within given date range.
+
+        Only sessions lying wholly within the range are counted.
+
+        :return: List of output dictionaries, one for every contributor,
+                 and output dictionary with totals
+        """
+        self.refresh()
+        index = self.session_index(cluster_algo, approx_algo, epsilon)
+
+        rows = sorted((stats._asdict() for stats in index.query(since, until)),
+                      key=lambda row: row['sessions'], reverse=True)
+
+        totals = OrderedDict(name="TOTAL")
+        for key in ('sessions', 'commits'):
+            totals[key] = sum(row[key] for row in rows)
+        totals['time'] = sum((row['time'] for row in rows), timedelta())
+        return rows, totals
+
+
+## HTTP server
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handler of HTTP requests for statistics.
+
+    ``GET /`` lists the names of served repositories, while
+    ``GET /stats/<name>`` returns statistics of a repository,
+    with optional query parameters: ``cluster_algo``, ``approx_algo``,
+    ``epsilon`` (in minutes), ``since``, ``until`` and ``format``.
+    """
+    server_version = 'coded4'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path.rstrip('/')
+        if not path:
+            body = json.dumps(sorted(self.server.repos))
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPES['json'])
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        prefix, _, name = path.lstrip('/').partition('/')
+        repo = self.server.repos.get(name) if prefix == 'stats' else None
+        if repo is None:
+            self.send_error(404)
+            return
+
+        try:
+            params = self.parse_params(parse_qs(url.query))
+            output_format = params.pop('format')
+            rows, totals = repo.query(**params)
+        except ValueError as e:  # including unknown algorithms
+            self.send_error(400, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES[output_format])
+        self.end_headers()
+        write_rows(self.wfile, repo.directory, rows, totals, output_format)
+
+    def parse_params(self, query):
+        """Parses and validates query parameters of stats request.
+        :raise ValueError: When any of the parameters is invalid
+        """
+        defaults = self.server.defaults
+        get = lambda key: query[key][-1] if key in query else None
+
+        params = dict((key, get(key) or defaults[key])
+                      for key in ('cluster_algo', 'approx_algo', 'format'))
+        if params['format'] not in CONTENT_TYPES:
+            raise ValueError("Unknown output format: %s" % params['format'])
+
+        epsilon = get('epsilon')
+        params['epsilon'] = (timedelta(minutes=int(epsilon)) if epsilon
+                             else defaults['epsilon'])
+        for key in ('since', 'until'):
+            value = get(key)
+            params[key] = parse_datetime(value) if value else None
+        return params
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return BaseHTTPServer.BaseHTTPRequestHandler.address_string(self)
+        return self.server.server_address  # Unix socket
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, format, *args)
+
+
+class WorkerPoolMixIn:
+    """Mix-in for SocketServer servers which handles requests
+    in a fixed number of worker threads.
+
+    Like the mix-ins in SocketServer itself, it's an old-style class.
+    """
+    workers = 4
+
+    def serve_forever(self, *args, **kwargs):
+        self.requests = Queue(self.workers * 2)
+        for _ in xrange(self.workers):
+            thread = threading.Thread(target=self.process_requests)
+            thread.daemon = True
+            thread.start()
+        SocketServer.BaseServer.serve_forever(self, *args, **kwargs)
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    def process_requests(self):
+        while True:
+            request, client_address = self.requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+class HTTPServer(WorkerPoolMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server listening on TCP port."""
+
+
+class UnixHTTPServer(WorkerPoolMixIn, SocketServer.UnixStreamServer):
+    """HTTP server listening on Unix socket."""
+
+
+def create_server(address, repos, defaults, workers=4, verbose=False):
+    """Creates the server for given repositories.
+
+    :param address: Either ``[HOST]:PORT`` to listen on TCP,
+                    or path to Unix socket
+    :param repos: Dictionary mapping names to Repository objects
+    :param defaults: Dictionary with default values of query parameters:
+                     ``cluster_algo``, ``approx_algo``, ``epsilon``
+                     and ``format``
+    :param workers: Number of threads handling requests
+    """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        server_class = HTTPServer
+        address = (host or 'localhost', int(port))
+    else:
+        server_class = UnixHTTPServer
+        if os.path.exists(address):
+            os.unlink(address)  # stale socket from previous run
+
+    server = server_class(address, RequestHandler)
+    server.workers = max(1, workers)
+    server.repos = repos
+    server.defaults = defaults
+    server.verbose = verbose
+    return server
+
+
+# Utilities
+
+def parse_datetime(s):
+    """Parses date (and time) given in one of the :data:`DATETIME_FORMATS`.
+    """
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(s, fmt)
+        except ValueError:
+            pass
+    raise ValueError("Invalid date: %s" % s)
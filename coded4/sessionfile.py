@@ -0,0 +1,178 @@
+"""
+Compact binary files with coding sessions of all contributors.
+
+The file consists of (with all integers little-endian):
+
+* header: magic string, format version (32-bit), number of sessions,
+  number of authors and size of the string table (all 64-bit);
+* columns of 64-bit integers, each with a value for every session:
+  author's index, ``start``, ``end``, ``commits``, ``time_before_first``
+  and ``time_after_last`` (times are in whole seconds);
+* string table: repository's name followed by names of authors,
+  each as 32-bit length and UTF-8 encoded bytes.
+
+Columns are aligned to 8 bytes, so that they can be used in place
+(e.g. by ``numpy.frombuffer``) at offsets given by
+:meth:`SessionFile.column_offset`.
+"""
+from array import array
+from itertools import imap, izip
+import mmap
+import struct
+import sys
+
+from coded4.approx import Session
+from coded4.history import INT_TYPECODE
+
+
+MAGIC = b'C4SS'
+VERSION = 1
+
+HEADER = struct.Struct(b'<4sIQQQ')
+STRING_LENGTH = struct.Struct(b'<I')
+
+#: Names of the columns, in the order they're stored in
+COLUMNS = ['author', 'start', 'end', 'commits',
+           'time_before_first', 'time_after_last']
+
+#: Whether arrays of INT_TYPECODE can hold the columns as they are
+NATIVE_COLUMNS = (array(INT_TYPECODE).itemsize == 8 and
+                  sys.byteorder == 'little')
+
+
+def write_session_file(out, repo_name, contributors):
+    """Writes coding sessions of given contributors as a session file.
+
+    :param out: Binary file-like object to write to
+    :param contributors: List of Contributor tuples (with their sessions)
+    """
+    strings = b''.join(
+        STRING_LENGTH.pack(len(encoded)) + encoded
+        for encoded in imap(to_utf8,
+                            [repo_name] + [c.name for c in contributors]))
+    session_count = sum(len(c.sessions) for c in contributors)
+    out.write(HEADER.pack(MAGIC, VERSION, session_count,
+                          len(contributors), len(strings)))
+
+    for column in COLUMNS:
+        for index, contributor in enumerate(contributors):
+            if column == 'author':
+                values = [index] * len(contributor.sessions)
+            else:
+                values = [int(round(getattr(session, column)))
+                          for session in contributor.sessions]
+            out.write(pack_int64s(values))
+
+    out.write(strings)
+
+
+class SessionFile(object):
+    """Session file opened for reading, which is memory-mapped
+    rather than read as a whole.
+
+    Names of the repository and authors are UTF-8 encoded byte strings,
+    same as when they're read from VCS.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mmap) < HEADER.size:
+            raise ValueError("Not a session file: %s" % path)
+        magic, version, self.session_count, author_count, strings_size = \
+            HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError("Not a session file: %s" % path)
+        if version != VERSION:
+            raise ValueError("Unsupported version of session file: %s"
+                             % version)
+
+        offset = HEADER.size + len(COLUMNS) * 8 * self.session_count
+        if len(self.mmap) < offset + strings_size:
+            raise ValueError("Truncated session file: %s" % path)
+
+        strings = []
+        for _ in xrange(author_count + 1):
+            length, = STRING_LENGTH.unpack_from(self.mmap, offset)
+            offset += STRING_LENGTH.size
+            strings.append(self.mmap[offset:offset + length])
+            offset += length
+        self.repo_name = strings[0]
+        self.authors = strings[1:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.session_count
+
+    def __getitem__(self, index):
+        """Reads a single session.
+        :return: Pair of author's name and Session tuple
+        """
+        if not 0 <= index < self.session_count:
+            raise IndexError("session index out of range")
+        values = [struct.unpack_from(b'<q', self.mmap,
+                                     self.column_offset(column) + 8 * index)[0]
+                  for column in COLUMNS]
+        return self.authors[values[0]], make_session(*values[1:])
+
+    def __iter__(self):
+        columns = map(self.column, COLUMNS)
+        for values in izip(*columns):
+            yield self.authors[values[0]], make_session(*values[1:])
+
+    def column_offset(self, name):
+        """Returns the offset (in bytes) of given column within the file."""
+        return HEADER.size + COLUMNS.index(name) * 8 * self.session_count
+
+    def column(self, name):
+        """Reads a whole column.
+        :return: Array (or list, on platforms without 64-bit arrays)
+                 of column's values, one for every session
+        """
+        offset = self.column_offset(name)
+        if NATIVE_COLUMNS:
+            return array(INT_TYPECODE,
+                         self.mmap[offset:offset + 8 * self.session_count])
+        return list(struct.unpack_from(b'<%dq' % self.session_count,
+                                       self.mmap, offset))
+
+    def coding_sessions(self):
+        """Reads all the sessions.
+        :return: Dictionary mapping contributor names to lists of Sessions
+        """
+        coding_sessions = dict((author, []) for author in self.authors)
+        for author, session in self:
+            coding_sessions[author].append(session)
+        return coding_sessions
+
+    def close(self):
+        self.mmap.close()
+
+
+# Utilities
+
+def make_session(start, end, commits, time_before_first, time_after_last):
+    """Creates Session tuple, computing its total time. """
+    return Session(start, end, commits, time_before_first, time_after_last,
+                   time_before_first + time_after_last + end - start)
+
+
+def to_utf8(s):
+    """Encodes string as UTF-8, unless it's a byte string already
+    (like names of authors read from VCS).
+    """
+    return s if isinstance(s, bytes) else s.encode('utf-8')
+
+
+def pack_int64s(values):
+    """Packs list of integers as little-endian 64-bit ones.
+    :return: Byte string
+    """
+    if NATIVE_COLUMNS:
+        return array(INT_TYPECODE, values).tostring()
+    return struct.pack(b'<%dq' % len(values), *values)
@@ -3,56 +3,178 @@ Code for calculating statistics based on commit history.
 """
 from collections import namedtuple
 from datetime import timedelta
-from itertools import chain, starmap
-
-from taipan.collections import dicts
+from functools import partial
+from itertools import starmap
+import math
 
 
 class Contributor(namedtuple('Contributor',
-                             ['name', 'sessions', 'total_time'])):
-    """Represents a single contributor to the repository."""
-
-    @property
-    def commits(self):
-        return list(chain(self.sessions))
+                             ['name', 'sessions', 'session_count',
+                              'commit_count', 'total_time', 'distributions'])):
+    """Represents a single contributor to the repository.
 
+    :param sessions: List of contributor's coding Sessions
+    :param session_count: Number of sessions
+    :param commit_count: Number of commits in all the sessions
+    :param total_time: Total coding time, as timedelta
+    :param distributions: SessionDistributions, or None if not computed
+    """
     @classmethod
-    def from_coding_sessions(cls, author, sessions):
+    def from_coding_sessions(cls, author, sessions, distributions=False):
         """Create the Contributor structure from author name
-        and list of coding Sessions.
+        and iterable of coding Sessions.
+
+        :param distributions: Whether SessionDistributions should be computed
         """
-        total_time = sum((s.total_time for s in sessions), timedelta())
-        return cls(author, sessions, total_time)
+        sessions = list(sessions)
+        commit_count = sum(s.commits for s in sessions)
+        total_time = timedelta(seconds=sum(s.total_time for s in sessions))
+        return cls(author, sessions, len(sessions), commit_count, total_time,
+                   SessionDistributions(sessions) if distributions else None)
 
 
-def compute_time_stats(coding_sessions):
+def compute_time_stats(coding_sessions, distributions=False):
     """Calculates time statistics,
     given list of coding sessions for every contributor.
 
     :param coding_sessions: Dictionary mapping contributor names
-                            to lists of coding Sessions
+                            to iterables of coding Sessions
+    :param distributions: Whether distributions of session lengths etc.
+                          should be computed as well
 
-    :return: List of Contributor tuples
+    :return: Iterable of Contributor tuples
     """
-    return starmap(Contributor.from_coding_sessions,
-                   dicts.iteritems(coding_sessions))
+    from_coding_sessions = partial(Contributor.from_coding_sessions,
+                                   distributions=distributions)
+    return starmap(from_coding_sessions, coding_sessions.iteritems())
 
 
 def calculate_totals(contributors):
-    """Given list of contributors, calculates aggregate statistics.
+    """Given contributors, calculates aggregate statistics.
 
-    :return: Fake Contributor tuple which contains the aggregated stats,
-             or None
+    Only the counters of contributors are summed up,
+    so it takes a single pass over (any iterable of) them.
+
+    :return: Fake Contributor tuple which contains the aggregated stats
+             (and no sessions); all zeros if there are no contributors
     """
-    if not contributors:
-        return
+    session_count = commit_count = 0
+    total_time = timedelta()
+    distributions = None
+    for c in contributors:
+        session_count += c.session_count
+        commit_count += c.commit_count
+        total_time += c.total_time
+        if c.distributions is not None:
+            if distributions is None:
+                distributions = SessionDistributions()
+            distributions.update(c.distributions)
 
-    measures = [('sessions', []), ('total_time', timedelta())]
+    return Contributor("TOTAL", None, session_count, commit_count,
+                       total_time, distributions)
 
-    sums = [initial for _, initial in measures]
-    for c in contributors:
-        for i in xrange(0, len(measures)):
-            attr, _ = measures[i]
-            sums[i] += getattr(c, attr)
 
-    return Contributor("TOTAL", *sums)
+## Distributions
+
+#: Quantiles of distributions that are output, along with their labels
+QUANTILES = [('median', 0.5), ('p90', 0.9)]
+
+
+class SessionDistributions(object):
+    """Distributions of session lengths, numbers of commits in sessions,
+    and gaps between subsequent sessions (from the last commit of one
+    to the first commit of the next), summarized as LogHistograms.
+
+    Distributions of many contributors or repositories can be merged
+    without going through their sessions again.
+    """
+    def __init__(self, sessions=()):
+        """Constructor.
+        :param sessions: Iterable of coding Sessions of a single contributor
+        """
+        self.lengths = LogHistogram()
+        self.commits = LogHistogram()
+        self.gaps = LogHistogram()
+
+        previous = None
+        for session in sorted(sessions, key=lambda s: s.start):
+            self.lengths.add(session.total_time)
+            self.commits.add(session.commits)
+            if previous:
+                self.gaps.add(session.start - previous.end)
+            previous = session
+
+    def update(self, other):
+        """Merges other SessionDistributions into this one."""
+        self.lengths.update(other.lengths)
+        self.commits.update(other.commits)
+        self.gaps.update(other.gaps)
+
+
+class LogHistogram(object):
+    """Histogram of non-negative values, with bucket boundaries
+    growing exponentially (and values below 1 counted as zeros).
+
+    Quantiles are estimated within a fixed relative error,
+    which depends on the number of buckets for every doubling of value.
+    Merging histograms is exact, as it only adds up the counts of buckets.
+    """
+    def __init__(self, buckets_per_doubling=8):
+        """Constructor.
+        :param buckets_per_doubling: Number of buckets for values
+                                     between any ``x`` and ``2x``; relative
+                                     error of quantiles is about
+                                     ``2 ** (0.5 / buckets_per_doubling) - 1``
+        """
+        self.buckets_per_doubling = buckets_per_doubling
+        self.counts = {}
+        self.total = 0
+        self.min = self.max = None
+
+    def __len__(self):
+        return self.total
+
+    def add(self, value, count=1):
+        """Adds a value to the histogram (given number of times)."""
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def update(self, other):
+        """Merges other LogHistogram (with the same buckets) into this one."""
+        if other.buckets_per_doubling != self.buckets_per_doubling:
+            raise ValueError("Can't merge histograms with different buckets")
+        for bucket, count in other.counts.iteritems():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """Estimates given quantile of the values (e.g. 0.5 for median).
+        :return: Estimated value, or 0 if the histogram is empty
+        """
+        if not self.total:
+            return 0
+
+        rank = max(1, int(math.ceil(q * self.total)))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                break
+
+        # geometric middle of the bucket is within the same relative error
+        # of any value that falls into it
+        value = (0 if bucket is None
+                 else 2 ** ((bucket + 0.5) / self.buckets_per_doubling))
+        return min(max(value, self.min), self.max)
+
+    def _bucket(self, value):
+        if value < 1:
+            return None  # sorts before any number
+        return int(math.floor(math.log(value, 2) * self.buckets_per_doubling))
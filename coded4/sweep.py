@@ -0,0 +1,170 @@
+"""
+Calculating statistics for many values of epsilon at once.
+"""
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import timedelta
+from itertools import imap, islice
+import operator
+
+from coded4 import approx, cluster
+from coded4.approx import MINUTE, SINGLE_COMMIT_TIMES
+
+
+#: Approximations which add a constant amount of time to every session,
+#: depending only on whether it has a single commit or more of them
+CONSTANT_APPROXIMATIONS = {
+    'null': (0, 0),
+    'start10': (10 * MINUTE, 10 * MINUTE),
+    'ten2five': (sum(SINGLE_COMMIT_TIMES), 15 * MINUTE),
+}
+
+
+def parse_epsilons(spec):
+    """Parses the specification of epsilon values to sweep over.
+
+    :param spec: Comma-separated list of minutes and/or inclusive ranges
+                 in the form of ``start:stop[:step]``, e.g. ``5:30:5,45,60``
+    :return: Sorted list of timedeltas, never empty
+    :raise ValueError: When the specification is invalid,
+                       or any of its ranges is empty
+    """
+    minutes = set()
+    for part in spec.split(','):
+        bounds = map(int, part.split(':'))
+        if len(bounds) == 1:
+            minutes.add(bounds[0])
+        elif len(bounds) in (2, 3):
+            start, stop, step = (bounds + [1])[:3]
+            if step <= 0:
+                raise ValueError("Invalid step of epsilon range: %s" % part)
+            if start > stop:
+                raise ValueError("Empty epsilon range: %s" % part)
+            minutes.update(xrange(start, stop + 1, step))
+        else:
+            raise ValueError("Invalid epsilon range: %s" % part)
+    return [timedelta(minutes=m) for m in sorted(minutes)]
+
+
+def sweep_epsilons(grouped_commits, epsilons, cluster_algo, approx_algo):
+    """Calculates the number of sessions and total time of every contributor
+    for each of given epsilon values.
+
+    For simple clustering and approximations that add constant time
+    to sessions, every epsilon is answered from sorted inter-commit gaps
+    in logarithmic time. Otherwise, commits are re-clustered for every epsilon
+    (though the history is still retrieved only once).
+
+    :param grouped_commits: Dictionary mapping contributor names
+                            to arrays of commit timestamps
+    :param epsilons: List of epsilon timedeltas
+    :return: List of output dictionaries, one for every contributor
+    """
+    if cluster_algo == 'simple' and approx_algo in CONSTANT_APPROXIMATIONS:
+        session_times = CONSTANT_APPROXIMATIONS[approx_algo]
+        stats_func = lambda times: GapIndex(times).stats(epsilons,
+                                                         session_times)
+    else:
+        stats_func = lambda times: recluster_stats(times, epsilons,
+                                                   cluster_algo, approx_algo)
+
+    rows = []
+    by_commits = sorted(grouped_commits.iteritems(),
+                        key=lambda (_, times): len(times), reverse=True)
+    for name, times in by_commits:
+        row = OrderedDict(name=name)
+        for epsilon, (sessions, seconds) in zip(epsilons, stats_func(times)):
+            label = epsilon_label(epsilon)
+            row['sessions_' + label] = sessions
+            row['time_' + label] = timedelta(seconds=seconds)
+        rows.append(row)
+    return rows
+
+
+def sweep_totals(rows):
+    """Calculates aggregate totals of rows returned by :func:`sweep_epsilons`.
+    :return: Output dictionary with totals, or None
+    """
+    if not rows:
+        return
+    totals = OrderedDict(name="TOTAL")
+    for key in islice(rows[0], 1, None):
+        totals[key] = sum((row[key] for row in rows),
+                          timedelta() if key.startswith('time_') else 0)
+    return totals
+
+
+def epsilon_label(epsilon):
+    """Returns short label of epsilon value, e.g. ``'30m'``. """
+    return '%dm' % (epsilon.total_seconds() // MINUTE)
+
+
+class GapIndex(object):
+    """Index of gaps between commits of a single contributor,
+    answering questions about clustering with any epsilon
+    in logarithmic time.
+    """
+    def __init__(self, times):
+        """Constructor.
+        :param times: Array of commit timestamps, latest first
+        """
+        gaps = list(imap(operator.sub, times, islice(times, 1, None)))
+
+        self.commit_count = len(times)
+        self.gaps = sorted(gaps)
+        self.gap_sums = [0]
+        for gap in self.gaps:
+            self.gap_sums.append(self.gap_sums[-1] + gap)
+
+        # commit ends up alone in its session when gaps to both its
+        # neighbors are larger than epsilon
+        infinity = float('inf')
+        before = [infinity] + gaps
+        after = gaps + [infinity]
+        self.isolations = sorted(imap(min, before, after)) if times else []
+
+    def session_count(self, max_gap):
+        """Number of sessions for epsilon of ``max_gap`` seconds. """
+        if not self.commit_count:
+            return 0
+        return 1 + len(self.gaps) - bisect_right(self.gaps, max_gap)
+
+    def single_commit_session_count(self, max_gap):
+        """Number of sessions with a single commit
+        for epsilon of ``max_gap`` seconds.
+        """
+        return len(self.isolations) - bisect_right(self.isolations, max_gap)
+
+    def spans_total(self, max_gap):
+        """Total time between first and last commits of all sessions
+        for epsilon of ``max_gap`` seconds.
+        """
+        return self.gap_sums[bisect_right(self.gaps, max_gap)]
+
+    def stats(self, epsilons, session_times):
+        """Yields the number of sessions and total time (in seconds)
+        for each of given epsilons.
+
+        :param session_times: Pair of times added to every session
+                              with a single and multiple commits, respectively
+        """
+        single_time, multiple_time = session_times
+        for epsilon in epsilons:
+            max_gap = epsilon.total_seconds()
+            sessions = self.session_count(max_gap)
+            singles = self.single_commit_session_count(max_gap)
+            seconds = (self.spans_total(max_gap) + singles * single_time +
+                       (sessions - singles) * multiple_time)
+            yield sessions, seconds
+
+
+def recluster_stats(times, epsilons, cluster_algo, approx_algo):
+    """Yields the number of sessions and total time (in seconds)
+    for each of given epsilons, by clustering the commits anew.
+    """
+    for epsilon in epsilons:
+        clustered = cluster.cluster_commits({None: times},
+                                            cluster_algo, epsilon)
+        sessions = approx.approximate_coding_sessions(clustered,
+                                                      approx_algo)[None]
+        yield len(sessions), sum(s.total_time for s in sessions)
@@ -1,12 +1,85 @@
 """
 Utility functions.
 """
-from subprocess import Popen, PIPE
+import os
+import time
 
 
 def exec_command(cmd, workdir=None):
     """Executes given shell command and returns its stdout as string.
     :param workdir: Working directory for the command
     """
+    from subprocess import Popen, PIPE
     cmd_out = Popen(cmd, shell=True, cwd=workdir, stdout=PIPE).stdout
     return cmd_out.read()
+
+
+def iter_command_output(cmd, workdir=None, separator='\n',
+                        chunk_size=64 * 1024):
+    """Executes given shell command and yields its stdout record by record,
+    as soon as the records become available.
+
+    :param workdir: Working directory for the command
+    :param separator: String which terminates every record
+    :param chunk_size: Size of chunks that the output is read in
+    """
+    return split_records(iter_command_chunks(cmd, workdir,
+                                             chunk_size=chunk_size),
+                         separator)
+
+
+def iter_command_chunks(cmd, workdir=None, quiet=False,
+                        chunk_size=64 * 1024):
+    """Executes given command and yields chunks of its stdout
+    as soon as they become available.
+
+    :param cmd: Shell command, or list of program's name and arguments
+    :param workdir: Working directory for the command
+    :param quiet: Whether anything the command writes to stderr
+                  should be discarded
+    :param chunk_size: Size of chunks that the output is read in
+
+    :raise CalledProcessError: When the command exits with non-zero status
+                               (after all of its output has been read)
+    """
+    from subprocess import CalledProcessError, Popen, PIPE
+
+    stderr = open(os.devnull, 'w') if quiet else None
+    process = Popen(cmd, shell=isinstance(cmd, basestring), cwd=workdir,
+                    stdout=PIPE, stderr=stderr)
+    try:
+        for chunk in iter(lambda: process.stdout.read(chunk_size), ''):
+            yield chunk
+    finally:
+        process.stdout.close()
+        process.wait()
+        if stderr:
+            stderr.close()
+    if process.returncode:
+        raise CalledProcessError(process.returncode, cmd)
+
+
+def split_records(chunks, separator='\n'):
+    """Splits a stream of string chunks into records.
+    :param separator: String which terminates every record
+    """
+    pending = ''
+    for chunk in chunks:
+        records = (pending + chunk).split(separator)
+        pending = records.pop()
+        for record in records:
+            yield record
+    if pending:
+        yield pending
+
+
+def default_cache_dir():
+    """Returns the default directory where commit history is cached. """
+    cache_home = (os.environ.get('XDG_CACHE_HOME') or
+                  os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'coded4')
+
+
+def to_timestamp(dt):
+    """Converts a naive datetime in local time into seconds since epoch. """
+    return int(time.mktime(dt.timetuple()))
@@ -1,113 +1,708 @@
 """
 Code for supporting specific VCS (version control systems).
 """
+from binascii import hexlify, unhexlify
 from collections import namedtuple
-from datetime import  datetime
+from datetime import timedelta
+from functools import partial
+from itertools import imap
+import operator
 import os
 
-from taipan.functional.functions import attr_func
+from coded4.utils import (exec_command, iter_command_chunks,
+                          iter_command_output, split_records, to_timestamp)
 
-from coded4.utils import exec_command
 
+SUPPORTED_VCS = ['git', 'hg', 'git-native', 'hg-server']
 
-SUPPORTED_VCS = ['git', 'hg']
+#: VCS which can be detected by presence of their directory in repo's root
+DETECTABLE_VCS = ['git', 'hg']
 
+#: Value of ``refs`` argument which selects commits from all branches,
+#: tags and bookmarks
+ALL_REFS = '*'
 
-def retrieve_commit_history(directory, vcs_name=None, interval=None):
+
+def retrieve_commit_history(directory, vcs_name=None, interval=None,
+                            after_revision=None, refs=None, merges=True,
+                            details=False, tip=None):
     """Retrieves history of commit for given repository.
-    :return: List of Commit tuples
+
+    Commits are streamed from the VCS as they are being read, in the order
+    in which it reports them (which is roughly, but not strictly,
+    the reverse chronological order). Every commit is retrieved only once,
+    even if it can be reached from many refs.
+
+    :param interval: Optional pair of datetimes (either of which may be None)
+                     that commits are filtered by, see :func:`filter_interval`;
+                     the VCS preselects them by its own, coarser criteria
+    :param after_revision: Optional revision, as returned by
+                           :func:`retrieve_tip`; if given, only commits
+                           that were made after it are retrieved
+    :param refs: List of names of refs (branches, tags, bookmarks)
+                 whose commits should be retrieved, or :data:`ALL_REFS`.
+                 By default, this is the current branch for Git
+                 and the whole repository for Mercurial
+    :param merges: Whether merge commits should be retrieved
+    :param details: Whether commit hashes and messages should be retrieved;
+                    by default, only times and authors are
+                    (with hashes and messages of Commits set to None)
+    :param tip: Optional revision, as returned by :func:`retrieve_tip`;
+                if given, only commits up to it are retrieved, even if more
+                have been added to the refs since it was read
+    :return: Iterable of Commit tuples
+    """
+    history_func = get_vcs_func(directory, vcs_name, 'history')
+    commits = history_func(directory, interval, after_revision, refs=refs,
+                           merges=merges, details=details, tip=tip)
+    return filter_interval(commits, interval)
+
+
+def retrieve_path_history(directory, vcs_name=None, interval=None,
+                          refs=None, merges=True):
+    """Retrieves history of commits for given repository,
+    along with paths of files that every commit has changed.
+
+    :param refs: Refs whose commits are retrieved,
+                 same as for :func:`retrieve_commit_history`
+    :param merges: Whether merge commits should be retrieved
+                   (with Git, they are listed without any paths)
+    :return: Iterable of pairs: Commit tuple (without details)
+             and list of paths relative to repository's root
+    """
+    path_history_func = get_vcs_func(directory, vcs_name, 'path_history')
+    return filter_interval(path_history_func(directory, interval, refs=refs,
+                                             merges=merges),
+                           interval, key=lambda (commit, _): commit.time)
+
+
+def retrieve_churn_history(directory, vcs_name=None, interval=None,
+                           refs=None, merges=True):
+    """Retrieves history of commits for given repository,
+    along with the number of lines that every commit has changed.
+
+    Output of the VCS is parsed as it's being read, keeping only
+    the counts of lines rather than statistics of every file.
+
+    :param refs: Refs whose commits are retrieved,
+                 same as for :func:`retrieve_commit_history`
+    :param merges: Whether merge commits should be retrieved
+    :return: Iterable of pairs: Commit tuple (without details)
+             and number of lines added and removed (binary files
+             don't count)
+    """
+    churn_history_func = get_vcs_func(directory, vcs_name, 'churn_history')
+    return filter_interval(churn_history_func(directory, interval, refs=refs,
+                                              merges=merges),
+                           interval, key=lambda (commit, _): commit.time)
+
+
+def retrieve_tip(directory, vcs_name=None, refs=None):
+    """Retrieves the identifier of most recent revision in given repository.
+
+    :param refs: Refs whose commits are retrieved,
+                 same as for :func:`retrieve_commit_history`
+    :return: Revision hash (or space-separated hashes of heads of given refs),
+             or empty string if the repository is empty
+    """
+    tip_func = get_vcs_func(directory, vcs_name, 'tip')
+    return tip_func(directory, refs=refs)
+
+
+def contains_revision(directory, revision, vcs_name=None, refs=None):
+    """Checks whether given revision (as returned by :func:`retrieve_tip`)
+    is part of repository's history that would be retrieved
+    by :func:`retrieve_commit_history`.
+    """
+    contains_func = get_vcs_func(directory, vcs_name, 'contains')
+    return contains_func(directory, revision, refs=refs)
+
+
+def filter_interval(items, interval, key=operator.attrgetter('time')):
+    """Filters the stream of commits, leaving only those that fall
+    within given time interval.
+
+    Commits are filtered by the time they are reported with, in the same way
+    for every VCS (and the cache). For Git, that's the author time,
+    rather than the committer time which ``git log --since`` would use,
+    so the VCS can only preselect them by the interval widened
+    with :data:`INTERVAL_MARGIN`.
+
+    :param items: Iterable of Commit tuples, or other items
+                  whose commit times are given by ``key``
+    :param interval: Pair of naive datetimes in local time
+                     (either of which may be None), or None
+    """
+    since, until = [to_timestamp(dt) if dt else None
+                    for dt in interval or (None, None)]
+    if since is None and until is None:
+        return items
+    return (item for item in items
+            if (since is None or key(item) >= since)
+            and (until is None or key(item) <= until))
+
+
+#: Time by which the interval is widened when the VCS preselects commits,
+#: as it may compare a different time than the one commits are reported with
+#: (e.g. Git's committer time), or interpret the bounds in another timezone
+INTERVAL_MARGIN = timedelta(days=1)
+
+
+def widen_interval(interval):
+    """Widens the interval of commits' times by :data:`INTERVAL_MARGIN`.
+    :return: Pair of naive datetimes (either of which may be None)
+    """
+    since, until = interval or (None, None)
+    return (since - INTERVAL_MARGIN if since else None,
+            until + INTERVAL_MARGIN if until else None)
+
+
+def get_vcs_func(directory, vcs_name, kind):
+    """Returns VCS-specific function of given kind
+    (e.g. ``'history'``) for repository in given directory.
     """
     vcs_name = vcs_name or detect_vcs(directory)
     if not vcs_name:
         raise ValueError("Could not find any known version control system "
                          "in given directory")
 
-    interval = interval or (None, None)
-
-    history_func = globals().get(vcs_name + '_history')
-    if not history_func:
+    if not supports(vcs_name, kind):
+        if vcs_name in SUPPORTED_VCS:
+            raise ValueError("Version control system '%s' doesn't support "
+                             "retrieving %s" % (vcs_name,
+                                                kind.replace('_', ' ')))
         raise ValueError(
             "Version control system '%s' is not supported" % vcs_name)
+    return globals()[vcs_func_name(vcs_name, kind)]
+
+
+def supports(vcs_name, kind):
+    """Checks whether given VCS has function of given kind
+    (e.g. ``'path_history'``).
+    """
+    return vcs_func_name(vcs_name, kind) in globals()
+
 
-    history = history_func(directory, interval)
-    return sorted(history, key=attr_func('time'), reverse=True)
+def vcs_func_name(vcs_name, kind):
+    """Returns name of VCS-specific function of given kind. """
+    return vcs_name.replace('-', '_') + '_' + kind
 
 
 def detect_vcs(directory):
     """Checks which of the supported VCS has repo in given directory.
     :return: Name of version control system found in given directory
     """
-    for vcs in SUPPORTED_VCS:
+    for vcs in DETECTABLE_VCS:
         vcs_dir = os.path.join(directory, '.' + vcs)
         if os.path.isdir(vcs_dir):
             return vcs
 
 
+#: Single commit, with its time expressed in seconds since epoch.
+#: Hash and message are None unless details were requested
 Commit = namedtuple('Commit', ['hash', 'time', 'author', 'message'])
 
+#: Separator of fields within a single log record
+FIELD_SEP = '\n'
+#: Terminator of log records
+RECORD_SEP = '\0'
+
+
+def intern_author(author):
+    """Returns the single shared copy of given author's name,
+    so that commits don't keep a copy each.
+    """
+    return intern(author)
+
 
 ### Git support
 
+GIT_LOG_FORMAT = '%x0a'.join(['%at', '%an'])
+GIT_DETAILED_LOG_FORMAT = '%x0a'.join(['%H', '%at', '%an', '%s'])
 GIT_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 
-def git_history(path, interval):
-    """Returns a list of Commit tuples with history for given Git repo. """
-    sep = '|'
-    git_log_format = sep.join(['%H', '%at', '%an', '%s'])
-    git_log = 'git log --format=format:"%s"' % git_log_format
+def git_history(path, interval=None, after_revision=None, refs=None,
+                merges=True, details=False, tip=None):
+    """Yields Commit tuples with history for given Git repo. """
+    records = git_log(path, '--format=format:"%s"%s' % (
+        GIT_DETAILED_LOG_FORMAT if details else GIT_LOG_FORMAT,
+        git_log_options(interval, after_revision, refs, merges, tip)),
+        refs, tip)
+    if details:
+        for record in records:
+            commit_hash, timestamp, author, message = record.split(FIELD_SEP, 3)
+            yield Commit(commit_hash, int(timestamp), intern_author(author),
+                         message)
+    else:
+        for record in records:
+            timestamp, author = record.split(FIELD_SEP, 1)
+            yield Commit(None, int(timestamp), intern_author(author), None)
+
+
+def git_path_history(path, interval=None, refs=None, merges=True):
+    """Yields pairs of Commit tuples and paths they have changed
+    for given Git repo.
+    """
+    tokens = git_log(path, '--name-only --format=format:"%s"%s' % (
+        GIT_LOG_FORMAT,
+        git_log_options(interval, refs=refs, merges=merges)), refs)
+    return split_git_file_records(tokens)
+
+
+def git_churn_history(path, interval=None, refs=None, merges=True):
+    """Yields pairs of Commit tuples and numbers of lines they have changed
+    for given Git repo.
+    """
+    tokens = git_log(path, '--numstat --format=format:"%s"%s' % (
+        GIT_LOG_FORMAT,
+        git_log_options(interval, refs=refs, merges=merges)), refs)
+    for commit, entries in split_git_file_records(tokens):
+        yield commit, sum(imap(parse_numstat, entries))
+
+
+def git_log(path, options, refs=None, tip=None):
+    """Runs ``git log -z`` with given options in given Git repo.
+
+    :param refs: Refs which the options select commits from
+    :param tip: Tip which the options select commits up to, if any
+    :return: Iterable of NUL-separated tokens of the output
+    :raise CalledProcessError: When ``git log`` fails,
+                               e.g. because of an unknown ref
+    """
+    if refs is None and not tip and not git_tip(path):
+        return iter([])  # empty repo, whose HEAD git log would reject
+    return iter_command_output('git log -z ' + options, path,
+                               separator=RECORD_SEP)
+
+
+def split_git_file_records(tokens):
+    """Splits NUL-separated ``git log -z`` output with a line for every
+    file (like ``--name-only`` or ``--numstat``) into commits.
+
+    :return: Iterable of pairs of Commit tuples and lists of their files'
+             lines (including paths of renamed files for ``--numstat``)
+    """
+    # every commit's header is followed by its files (the first one
+    # after a newline), each terminated by NUL, with an extra NUL
+    # after the last one; commits without files have only the header
+    commit, files = None, []
+    for token in tokens:
+        if FIELD_SEP in token:
+            if commit:
+                yield commit, files
+            fields = token.split(FIELD_SEP, 2)
+            timestamp, author = fields[:2]
+            commit = Commit(None, int(timestamp), intern_author(author), None)
+            files = fields[2:]
+        elif token:
+            files.append(token)
+    if commit:
+        yield commit, files
+
+
+def parse_numstat(line):
+    """Parses a line of ``git log --numstat -z`` output.
+
+    :return: Number of lines added and removed; 0 for binary files,
+             as well as for the paths which follow renames' lines
+    """
+    fields = line.split('\t', 2)
+    if len(fields) < 3:
+        return 0
+    return sum(int(count) for count in fields[:2] if count.isdigit())
+
 
-    since, until = interval
+def git_log_options(interval=None, after_revision=None, refs=None,
+                    merges=True, tip=None):
+    """Returns options for ``git log`` which select commits
+    committed within (widened) interval, made after given revision,
+    from given refs (or up to given tip) and/or without merges.
+    """
+    options = ''
+    # commits are committed no earlier than they're authored (save for
+    # clock skew), while they can be committed long after (e.g. rebased),
+    # so only the start of the interval can be used with committer time
+    since, _ = widen_interval(interval)
     if since:
-        git_log += ' --since="%s"' % since.strftime(GIT_TIME_FORMAT)
-    if until:
-        git_log += ' --until="%s"' % until.strftime(GIT_TIME_FORMAT)
+        options += ' --since="%s"' % since.strftime(GIT_TIME_FORMAT)
+    if not merges:
+        options += ' --no-merges'
+    if tip:
+        options += ' ' + tip
+    elif refs is not None or after_revision:
+        options += ' ' + git_revisions(refs)
+    if after_revision:
+        options += ' --not %s' % after_revision
+    return options
+
+
+def git_tip(path, refs=None):
+    """Returns the hash of HEAD commit in given Git repo,
+    or hashes of commits that given refs point to.
+    """
+    if refs is None:
+        return exec_command('git rev-parse --verify -q HEAD', path).strip()
+
+    git_rev_list = 'git rev-list --no-walk %s 2>%s' % (git_revisions(refs),
+                                                       os.devnull)
+    return ' '.join(sorted(set(exec_command(git_rev_list, path).split())))
+
+
+def git_contains(path, revision, refs=None):
+    """Checks whether given revision is an ancestor of HEAD
+    (or of given refs) in Git repo.
+    """
+    if refs is None:
+        git_merge_base = 'git merge-base --is-ancestor %s HEAD 2>%s && echo yes'
+        return bool(exec_command(git_merge_base % (revision, os.devnull),
+                                 path).strip())
+
+    # all of the revisions must be reachable from the refs
+    git_rev_list = 'git rev-list -n 1 %s --not %s 2>%s || echo missing'
+    return not exec_command(git_rev_list % (revision, git_revisions(refs),
+                                            os.devnull), path).strip()
+
+
+def git_revisions(refs):
+    """Returns arguments for Git commands which select given refs. """
+    if refs is None:
+        return 'HEAD'
+    if refs == ALL_REFS:
+        return 'HEAD --branches --tags --remotes'
+    import pipes
+    return ' '.join(map(pipes.quote, refs))
+
+
+### Native Git support (reading the object database directly)
 
-    log = exec_command(git_log, path)
+def git_native_history(path, interval=None, after_revision=None, refs=None,
+                       merges=True, details=False, tip=None):
+    """Yields Commit tuples with history for given Git repo,
+    without invoking the ``git`` binary.
 
-    history = []
-    for line in log.splitlines():
-        commit_hash, timestamp, author, message = line.split(sep, 3)
-        time = datetime.fromtimestamp(float(timestamp))
-        history.append(Commit(commit_hash, time, author, message))
+    Commits aren't preselected by the interval, as all of them
+    have to be walked through anyway.
+    """
+    from coded4.gitobjects import Repository
+
+    repo = Repository(path)
+    try:
+        heads = (map(unhexlify, tip.split()) if tip
+                 else git_native_heads(repo, refs))
+        if not heads:
+            return
+
+        exclude = map(unhexlify, after_revision.split() if after_revision
+                      else [])
+        for sha, commit in repo.walk_commits(heads, exclude):
+            if not merges and len(commit.parents) > 1:
+                continue
+            author = intern_author(commit.author)
+            if details:
+                yield Commit(hexlify(sha), commit.time, author, commit.message)
+            else:
+                yield Commit(None, commit.time, author, None)
+    finally:
+        repo.close()
+
+
+def git_native_tip(path, refs=None):
+    """Returns the hash of HEAD commit in given Git repo
+    (or hashes of commits that given refs point to),
+    without invoking the ``git`` binary.
+    """
+    from coded4.gitobjects import Repository
+
+    repo = Repository(path)
+    try:
+        return ' '.join(sorted(map(hexlify, git_native_heads(repo, refs))))
+    finally:
+        repo.close()
+
+
+def git_native_contains(path, revision, refs=None):
+    """Checks whether given revision is an ancestor of HEAD
+    (or of given refs) in Git repo, without invoking the ``git`` binary.
+    """
+    from coded4.gitobjects import Repository
 
-    return history
+    repo = Repository(path)
+    try:
+        wanted = set(map(unhexlify, revision.split()))
+        for sha, _ in repo.walk_commits(git_native_heads(repo, refs)):
+            wanted.discard(sha)
+            if not wanted:
+                return True
+        return False
+    finally:
+        repo.close()
+
+
+def git_native_heads(repo, refs):
+    """Returns binary SHAs of commits that given refs point to,
+    in given gitobjects.Repository.
+
+    :raise ValueError: When any of the given refs doesn't exist
+    """
+    from coded4.gitobjects import OBJ_COMMIT
+
+    if refs is None:
+        shas = [repo.resolve_ref('HEAD')]
+    elif refs == ALL_REFS:
+        shas = [repo.resolve_ref('HEAD')] + [
+            sha for name, sha in repo.list_refs().iteritems()
+            if name.startswith(('refs/heads/', 'refs/tags/', 'refs/remotes/'))]
+    else:
+        shas = map(repo.find_ref, refs)
+        for ref, sha in zip(refs, shas):
+            if sha is None:
+                raise ValueError("Unknown ref '%s'" % ref)
+
+    heads = set()
+    for sha in filter(None, shas):
+        sha, obj_type = repo.peel(sha)
+        if obj_type == OBJ_COMMIT:  # tags can also point to trees etc.
+            heads.add(sha)
+    return sorted(heads)
 
 
 ### Hg support
 
+HG_LOG_TEMPLATE = r'\n'.join(['{date|hgdate}', '{author|person}']) + r'\0'
+HG_DETAILED_LOG_TEMPLATE = r'\n'.join(['{node}', '{date|hgdate}',
+                                       '{author|person}',
+                                       '{desc|firstline}']) + r'\0'
+HG_PATH_LOG_TEMPLATE = r'\n'.join(['{date|hgdate}', '{author|person}',
+                                   r"{join(files, '\n')}"]) + r'\0'
+HG_CHURN_LOG_TEMPLATE = r'\n'.join(['{date|hgdate}', '{author|person}',
+                                    '{diffstat}']) + r'\0'
 HG_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 
-def hg_history(path, interval):
-    """Returns a list of Commit tuples with history
+def hg_process(path):
+    """Returns function which runs hg commands in given Mercurial repo,
+    starting a new ``hg`` process for every one of them.
+
+    The function takes the list of command's arguments (without ``hg``
+    itself) and optional ``quiet`` flag which makes it discard
+    anything written to stderr, and returns an iterable of output chunks.
+    """
+    def run(args, quiet=False):
+        return iter_command_chunks(['hg'] + args, path, quiet=quiet)
+    return run
+
+
+def hg_command_server(path):
+    """Returns function which runs hg commands in given Mercurial repo,
+    like :func:`hg_process`, querying a (persistent) Mercurial command server
+    (which always discards stderr).
+    """
+    from coded4.hgserver import get_server
+
+    server = get_server(path)
+    return lambda args, quiet=False: server.run_command(args)
+
+
+def hg_history(path, interval=None, after_revision=None, refs=None,
+               merges=True, details=False, tip=None, connect=hg_process):
+    """Yields Commit tuples with history for given Mercurial repo.
+
+    :param connect: Function returning the function which runs hg commands
+                    in given repo, i.e. :func:`hg_process`
+                    or :func:`hg_command_server`
+    """
+    args = hg_log_args(HG_DETAILED_LOG_TEMPLATE if details
+                       else HG_LOG_TEMPLATE,
+                       hg_revset(interval, after_revision, refs, merges, tip))
+    records = split_records(connect(path)(args), separator=RECORD_SEP)
+    return parse_hg_records(records, details)
+
+
+def hg_path_history(path, interval=None, refs=None, merges=True,
+                    connect=hg_process):
+    """Yields pairs of Commit tuples and paths they have changed
     for given Mercurial repo.
     """
-    sep = '|'
-    hg_log_template = sep.join(['{node}', '{date|hgdate}',
-                                '{author|person}', '{desc|firstline}'])
-    hg_log = r'hg log --template "%s\n"' % hg_log_template
+    args = hg_log_args(HG_PATH_LOG_TEMPLATE,
+                       hg_revset(interval, refs=refs, merges=merges))
+    records = split_records(connect(path)(args), separator=RECORD_SEP)
+    return parse_hg_path_records(records)
+
+
+def hg_churn_history(path, interval=None, refs=None, merges=True,
+                     connect=hg_process):
+    """Yields pairs of Commit tuples and numbers of lines they have changed
+    for given Mercurial repo.
+    """
+    args = hg_log_args(HG_CHURN_LOG_TEMPLATE,
+                       hg_revset(interval, refs=refs, merges=merges))
+    records = split_records(connect(path)(args), separator=RECORD_SEP)
+    return parse_hg_churn_records(records)
+
+
+def hg_tip(path, refs=None, connect=hg_process):
+    """Returns the hash of tip changeset in given Mercurial repo,
+    or hashes of heads of given refs.
+    """
+    run = connect(path)
+    ancestors = hg_ancestors_revset(refs)
+    if ancestors:
+        args = hg_log_args('{node}\n', 'heads(%s)' % ancestors)
+        return ' '.join(sorted(''.join(run(args, quiet=True)).split()))
+
+    tip = ''.join(run(hg_log_args('{node}', 'tip'))).strip()
+    return tip if tip.strip('0') else ''  # null changeset means empty repo
+
 
-    # add date filter if interval is specified
-    date_filter = None
-    since, until = interval
+def hg_contains(path, revision, refs=None, connect=hg_process):
+    """Checks whether given changeset exists in Mercurial repo
+    (and is an ancestor of given refs).
+    """
+    from subprocess import CalledProcessError
+
+    args = hg_log_args('{node}\n', hg_contains_revset(revision, refs))
+    try:
+        output = ''.join(connect(path)(args, quiet=True))
+    except CalledProcessError:
+        return False  # revision is unknown, e.g. stripped
+    return len(output.split()) == len(revision.split())
+
+
+def hg_log_args(template, revset=None):
+    """Returns arguments of ``hg log`` which outputs changesets
+    selected by given revset (or all of them) with given template.
+    """
+    args = ['log', '--template', template]
+    if revset:
+        args.extend(['-r', revset])
+    return args
+
+
+def hg_revset(interval=None, after_revision=None, refs=None, merges=True,
+              tip=None):
+    """Builds the revset which selects changesets (optionally) only
+    if they were made within (widened) interval, added after given revision
+    (and up to given tip), are ancestors of given refs and/or aren't merges.
+
+    :return: Revset string, or None if all changesets should be selected
+    """
+    predicates = []
+    since, until = [dt.strftime(HG_TIME_FORMAT) if dt else None
+                    for dt in widen_interval(interval)]
     if since and until:
-        date_filter = '%s to %s' % (since.strftime(HG_TIME_FORMAT),
-                                    until.strftime(HG_TIME_FORMAT))
+        predicates.append("date('%s to %s')" % (since, until))
     elif since:
-        date_filter = '>' + since.strftime(HG_TIME_FORMAT)
+        predicates.append("date('>%s')" % since)
     elif until:
-        date_filter = '<' + until.strftime(HG_TIME_FORMAT)
-    if date_filter:
-        hg_log += ' --date "%s"' % date_filter
+        predicates.append("date('<%s')" % until)
+    ancestors = hg_ancestors_revset(refs)
+    if ancestors:
+        if tip:
+            ancestors = hg_ancestors_revset(tip.split())  # heads of refs
+        predicates.append(ancestors)
+        if after_revision:
+            predicates.append(
+                'not ::(%s)' % ' or '.join(after_revision.split()))
+    elif after_revision:
+        predicates.append('%s:%s - %s' % (after_revision, tip or 'tip',
+                                          after_revision))
+    elif tip:
+        predicates.append(':' + tip)
+    if not merges:
+        predicates.append('not merge()')
+
+    return ' and '.join('(%s)' % p for p in predicates) or None
+
+
+def hg_ancestors_revset(refs):
+    """Builds the revset which selects ancestors of given refs
+    (bookmarks, branches, tags).
+
+    :return: Revset string, or None if all changesets should be selected
+    """
+    if refs is None or refs == ALL_REFS:
+        return None  # hg log shows changesets from all branches anyway
+    return '::(%s)' % ' or '.join("'%s'" % ref for ref in refs)
+
+
+def hg_contains_revset(revision, refs):
+    """Builds the revset which selects those of given (space-separated)
+    changesets which are part of the history of given refs.
+    """
+    revset = ' or '.join(revision.split())
+    ancestors = hg_ancestors_revset(refs)
+    if ancestors:
+        revset = '%s and (%s)' % (ancestors, revset)
+    return revset
+
+
+def parse_hg_records(records, details=False):
+    """Parses records of ``hg log`` output, formatted according
+    to HG_DETAILED_LOG_TEMPLATE or (if ``details`` is False) HG_LOG_TEMPLATE.
+
+    :return: Iterable of Commit tuples
+    """
+    for record in records:
+        if details:
+            commit_hash, hg_time, author, message = record.split(FIELD_SEP, 3)
+        else:
+            commit_hash, message = None, None
+            hg_time, author = record.split(FIELD_SEP, 1)
+        yield Commit(commit_hash, parse_hgdate(hg_time), intern_author(author),
+                     message)
+
+
+def parse_hg_path_records(records):
+    """Parses records of ``hg log`` output,
+    formatted according to HG_PATH_LOG_TEMPLATE.
+
+    :return: Iterable of pairs of Commit tuples and lists of paths
+    """
+    for record in records:
+        fields = record.split(FIELD_SEP)
+        hg_time, author = fields[:2]
+        commit = Commit(None, parse_hgdate(hg_time), intern_author(author),
+                        None)
+        yield commit, filter(None, fields[2:])
+
+
+def parse_hg_churn_records(records):
+    """Parses records of ``hg log`` output,
+    formatted according to HG_CHURN_LOG_TEMPLATE.
+
+    :return: Iterable of pairs of Commit tuples and numbers of lines changed
+    """
+    for record in records:
+        hg_time, author, diffstat = record.split(FIELD_SEP, 2)
+        commit = Commit(None, parse_hgdate(hg_time), intern_author(author),
+                        None)
+        yield commit, parse_diffstat(diffstat)
+
+
+def parse_hgdate(hg_time):
+    """Parses Mercurial's ``{date|hgdate}``, i.e. ``timestamp tz_offset``.
+    :return: Timestamp in seconds since epoch (in UTC)
+    """
+    return int(hg_time.split(None, 1)[0])
+
+
+def parse_diffstat(diffstat):
+    """Parses Mercurial's ``{diffstat}``, i.e. ``files: +added/-removed``.
+    :return: Number of lines added and removed
+    """
+    _, _, lines = diffstat.partition(': ')
+    added, _, removed = lines.partition('/')
+    return int(added.lstrip('+') or 0) + int(removed.lstrip('-') or 0)
+
 
-    log = exec_command(hg_log, path)
+### Hg command server support
 
-    history = []
-    for line in log.splitlines():
-        commit_hash, hg_time, author, message = line.split(sep, 3)
-        hg_time = sum(map(int, hg_time.split()), 0)  # hg_time is 'local_timestamp timezone_offset'
-        time = datetime.fromtimestamp(hg_time)
-        history.append(Commit(commit_hash, time, author, message))
+# same as the functions above, but running hg commands
+# through a (persistent) Mercurial command server
 
-    return history
+hg_server_history = partial(hg_history, connect=hg_command_server)
+hg_server_path_history = partial(hg_path_history, connect=hg_command_server)
+hg_server_churn_history = partial(hg_churn_history, connect=hg_command_server)
+hg_server_tip = partial(hg_tip, connect=hg_command_server)
+hg_server_contains = partial(hg_contains, connect=hg_command_server)
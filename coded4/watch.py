@@ -0,0 +1,109 @@
+"""
+Following a repository as new commits arrive,
+keeping the coding sessions up to date.
+"""
+from array import array
+from itertools import chain, izip
+import operator
+import time
+
+from coded4 import approx, cluster, vcs
+from coded4.approx import Session
+from coded4.history import INT_TYPECODE
+
+
+class SessionTracker(object):
+    """Coding sessions of all contributors, which are updated
+    with new commits without clustering the whole history again.
+    """
+    def __init__(self, grouped_commits, cluster_algo, epsilon, approx_algo):
+        """Constructor.
+
+        :param grouped_commits: Dictionary mapping contributor names
+                                to arrays of commit timestamps,
+                                from the latest to the earliest
+        """
+        self.grouped_commits = grouped_commits
+        self.cluster_algo = cluster_algo
+        self.epsilon = epsilon
+        self.approx_algo = approx_algo
+
+        self.coding_sessions = approx.approximate_coding_sessions(
+            cluster.cluster_commits(grouped_commits, cluster_algo, epsilon),
+            approx_algo)
+        self.approx_func = getattr(approx, approx_algo + '_approximation')
+
+    def add_commits(self, commits):
+        """Updates coding sessions with given Commit tuples."""
+        for commit in sorted(commits, key=operator.attrgetter('time')):
+            self.add_commit(commit.author, commit.time)
+
+    def add_commit(self, author, commit_time):
+        """Updates coding sessions of given author with a new commit.
+
+        Usually, the commit is the latest one, so it either extends
+        author's latest session or starts a new one (according to the rule
+        of simple clustering). Otherwise, all of author's sessions
+        are found anew.
+        """
+        times = self.grouped_commits.setdefault(author, array(INT_TYPECODE))
+        sessions = self.coding_sessions.setdefault(author, [])
+
+        if self.cluster_algo != 'simple' or (times and commit_time < times[0]):
+            self.grouped_commits[author] = times = array(
+                INT_TYPECODE, sorted(chain(times, [commit_time]), reverse=True))
+            clustered = cluster.cluster_commits(
+                {author: times}, self.cluster_algo, self.epsilon)
+            self.coding_sessions.update(approx.approximate_coding_sessions(
+                clustered, self.approx_algo))
+            return
+
+        # both commits and sessions go from the latest to the earliest
+        times.insert(0, commit_time)
+        latest = sessions[0] if sessions else None
+        max_gap = self.epsilon.total_seconds()
+        if latest and commit_time - latest.end <= max_gap:
+            sessions[0] = self.session(latest.start, commit_time,
+                                       latest.commits + 1)
+        else:
+            sessions.insert(0, self.session(commit_time, commit_time, 1))
+
+    def session(self, start, end, commits):
+        """Creates Session tuple, approximating time before first
+        and after last commit.
+        """
+        span = end - start
+        # some approximations return infinite iterables, so take only
+        # the first pair of values rather than unpacking them whole
+        before, after = next(izip(*self.approx_func([commits], [span])))
+        return Session(start, end, commits, before, after,
+                       before + after + span)
+
+
+def follow(directory, vcs_name, tip, poll_interval, refs=None, merges=True):
+    """Polls the repository for new commits.
+
+    :param tip: Revision that the commits are known up to
+    :param poll_interval: Number of seconds between checks of the repository
+    :param refs: Refs whose commits are retrieved,
+                 see :func:`coded4.vcs.retrieve_commit_history`
+    :param merges: Whether merge commits are retrieved
+
+    :return: Iterable of lists of Commit tuples, one for every change
+             of repository's tip, or None if history has been rewritten
+             and has to be retrieved anew
+    """
+    vcs_name = vcs_name or vcs.detect_vcs(directory)
+    while True:
+        time.sleep(poll_interval)
+        new_tip = vcs.retrieve_tip(directory, vcs_name, refs=refs)
+        if new_tip == tip:
+            continue
+
+        if tip and vcs.contains_revision(directory, tip, vcs_name, refs=refs):
+            yield list(vcs.retrieve_commit_history(
+                directory, vcs_name, after_revision=tip, tip=new_tip,
+                refs=refs, merges=merges))
+        else:
+            yield None
+        tip = new_tip